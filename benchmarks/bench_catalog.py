@@ -0,0 +1,112 @@
+"""
+Benchmark and check the result catalog on a synthetic tree of empty files.
+
+The tree has one run directory per sampler with an :code:`injection_<id>`
+directory for each injection, containing result files with several
+extensions, and a data release directory with cosmo and nocosmo GWTC files.
+The script times the first and an unchanged refresh of the catalog and
+checks that the catalog and the glob searches return the same files, for
+both the short, e.g. :code:`GW150914`, and full event names. Exits with a
+non-zero status if any check fails.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from gw_smc_utils.catalog import ResultCatalog
+from gw_smc_utils.results import find_gwtc_results
+
+EVENTS = ["GW150914_095045", "GW151012_095443", "GW190521_030229"]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n-injections", type=int, default=1000)
+    parser.add_argument("--output", type=str, default=None)
+    return parser
+
+
+def make_tree(root, n_injections):
+    """Create the synthetic tree of empty files."""
+    for sampler in ["dynesty", "pocomc"]:
+        run = root / "results" / f"outdir_{sampler}_2det_pp"
+        for i in range(n_injections):
+            directory = run / f"injection_{i}" / "final_result"
+            directory.mkdir(parents=True)
+            for extension in ["hdf5", "json"]:
+                (directory / f"{sampler}_{i}_result.{extension}").touch()
+    release = root / "releases" / "GWTC-2.1"
+    release.mkdir(parents=True)
+    for event in EVENTS:
+        for suffix in ["cosmo", "nocosmo"]:
+            (release / f"IGWN-GWTC2p1-v2-{event}_PEDataRelease_{suffix}.h5").touch()
+
+
+def walk_result_files(result_dir, extension):
+    """Find the result files without the catalog, as in :code:`pp_test.py`."""
+    result_files = {}
+    for dirpath, _, filenames in os.walk(result_dir):
+        if "final_result" in dirpath:
+            for filename in filenames:
+                if filename.endswith(extension):
+                    inj_id = int(
+                        os.path.basename(os.path.dirname(dirpath)).split("_")[-1]
+                    )
+                    result_files[inj_id] = Path(dirpath, filename)
+    return dict(sorted(result_files.items()))
+
+
+def main(n_injections=1000, output=None):
+    failed = []
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        make_tree(root, n_injections)
+        with ResultCatalog(str(root / "catalog.sqlite")) as catalog:
+            for name in ["first_refresh", "unchanged_refresh"]:
+                start = time.perf_counter()
+                n_listed = catalog.refresh(root)
+                results[name] = dict(
+                    wall_time=time.perf_counter() - start, n_listed=n_listed
+                )
+                print(
+                    f"{name}: {results[name]['wall_time']:.3f} s, "
+                    f"listed {n_listed} directories"
+                )
+
+            for event in EVENTS + [event.split("_")[0] for event in EVENTS]:
+                for cosmo in [False, True]:
+                    found = [
+                        find_gwtc_results(
+                            root / "releases", ["GWTC-2.1"], event, cosmo, catalog=c
+                        )
+                        for c in [None, catalog]
+                    ]
+                    if found[0] != found[1]:
+                        failed.append(f"{event} cosmo={cosmo}: {found}")
+
+            result_dir = root / "results" / "outdir_pocomc_2det_pp"
+            for extension in ["hdf5", "json"]:
+                expected = walk_result_files(result_dir, extension)
+                found = catalog.result_files(directory=result_dir, extension=extension)
+                if len(expected) != n_injections or found != expected:
+                    failed.append(f"result files with extension {extension}")
+
+    for failure in failed:
+        print(f"FAIL {failure}")
+    print("PASS" if not failed else f"{len(failed)} checks failed")
+    if output is not None:
+        with open(output, "w") as fp:
+            json.dump(dict(results=results, failed=failed), fp, indent=4)
+    return not failed
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    passed = main(n_injections=args.n_injections, output=args.output)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,113 @@
+"""
+Check the time taken to import each module in gw_smc_utils.
+
+Each module is imported in a fresh interpreter with :code:`python -X
+importtime` and the cumulative import time is compared to a budget. The
+check also fails if importing the module loads any of the slow optional
+dependencies, which should only be imported when they are used. Exits with a
+non-zero status if any module is over budget.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Budgets for the cumulative import time in milliseconds, including numpy,
+# scipy.special and h5py where they are used
+BUDGETS = {
+    "gw_smc_utils": 50,
+    "gw_smc_utils.batch": 300,
+    "gw_smc_utils.catalog": 50,
+    "gw_smc_utils.js": 600,
+    "gw_smc_utils.jsd_store": 300,
+    "gw_smc_utils.kde": 600,
+    "gw_smc_utils.posterior": 400,
+    "gw_smc_utils.pp": 400,
+    "gw_smc_utils.results": 50,
+    "gw_smc_utils.shared": 300,
+    "gw_smc_utils.summary": 400,
+    "gw_smc_utils.utils": 600,
+    "gw_smc_utils.plotting": 300,
+    "gw_smc_utils.cli.batch_js": 50,
+    "gw_smc_utils.cli.event_plots": 300,
+}
+
+# Modules that should not be loaded when importing gw_smc_utils
+SLOW_MODULES = [
+    "bilby",
+    "matplotlib",
+    "pesummary",
+    "scipy.signal",
+    "scipy.spatial",
+    "scipy.stats",
+]
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--modules", type=str, nargs="+", default=list(BUDGETS))
+    parser.add_argument("--n-repeats", type=int, default=3)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Factor to scale the budgets by, e.g. for slower machines",
+    )
+    parser.add_argument("--output", type=str, default=None)
+    return parser
+
+
+def import_time(module):
+    """Return the cumulative import time in milliseconds for a module and
+    the slow modules that were loaded."""
+    code = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {SLOW_MODULES!r} if m in sys.modules]))"
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # Lines are "import time: self [us] | cumulative | imported package"
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e3, json.loads(process.stdout)
+    raise RuntimeError(f"Could not find the import time for {module}")
+
+
+def main(modules, n_repeats=3, scale=1.0, output=None):
+    results = {}
+    failed = False
+    for module in modules:
+        times, loaded = zip(*(import_time(module) for _ in range(n_repeats)))
+        budget = scale * BUDGETS.get(module, 300)
+        time = min(times)
+        ok = time <= budget and not loaded[0]
+        failed |= not ok
+        results[module] = dict(time=time, budget=budget, slow_modules=loaded[0])
+        print(
+            f"{'PASS' if ok else 'FAIL'} {module:<30s} {time:7.1f} ms "
+            f"(budget {budget:.0f} ms)"
+            + (f", loaded {', '.join(loaded[0])}" if loaded[0] else "")
+        )
+    if output is not None:
+        with open(output, "w") as fp:
+            json.dump(results, fp, indent=4)
+    return not failed
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    passed = main(
+        modules=args.modules,
+        n_repeats=args.n_repeats,
+        scale=args.scale,
+        output=args.output,
+    )
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,190 @@
+"""
+Benchmark the JS divergence calculation on synthetic posteriors.
+
+For each parameter and each combination of the number of samples, number of
+grid points, number of replicates and KDE method, this records the wall
+time, the peak RSS and the error compared to a high-resolution reference,
+computed with the exact KDEs using all the samples.
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+from common import PARAMETERS, measure, posterior_pair, write_results
+
+from gw_smc_utils import js
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=str, default="bench_js.json")
+    parser.add_argument("--parameters", type=str, nargs="+", default=list(PARAMETERS))
+    parser.add_argument("--n-posterior", type=int, default=20_000)
+    parser.add_argument("--n-samples", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--xsteps", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--n-tests", type=int, nargs="+", default=[10])
+    parser.add_argument("--methods", type=str, nargs="+", default=["exact", "fft"])
+    parser.add_argument("--batched", action="store_true")
+    parser.add_argument("--reference-xsteps", type=int, default=4000)
+    parser.add_argument(
+        "--shift",
+        type=float,
+        default=0.0,
+        help="Shift between the two posteriors, zero gives a JSD close to zero",
+    )
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--n-pool", type=int, default=None)
+    return parser
+
+
+def _setup(parameter, n_posterior, seed, shift, n_pool, **kwargs):
+    post_a, post_b = posterior_pair(n_posterior, seed=seed, shift=shift)
+    pool = None
+    if n_pool is not None:
+        from multiprocessing import Pool
+
+        pool = Pool(n_pool)
+    return post_a[parameter], post_b[parameter], pool
+
+
+def run_case(
+    setup,
+    parameter,
+    n_samples,
+    xsteps,
+    n_tests,
+    method,
+    batched,
+    seed,
+    **kwargs,
+):
+    samples_a, samples_b, pool = setup
+    try:
+        values = js.calculate_js(
+            samples_a,
+            samples_b,
+            n_tests=n_tests,
+            xsteps=xsteps,
+            n_samples=n_samples,
+            base=2,
+            rng=np.random.default_rng(seed),
+            verbose=False,
+            pool=pool,
+            batched=batched,
+            method=method,
+            **PARAMETERS[parameter],
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+    return [float(v) for v in values]
+
+
+run_case.setup = _setup
+
+
+def reference_js(samples_a, samples_b, parameter, xsteps):
+    """JSD using all the samples, the exact KDEs and a fine grid."""
+    return float(
+        js._compute_js(
+            samples_a,
+            samples_b,
+            xsteps=xsteps,
+            base=2,
+            method="exact",
+            **PARAMETERS[parameter],
+        )
+    )
+
+
+def main(
+    output,
+    parameters,
+    n_posterior,
+    n_samples,
+    xsteps,
+    n_tests,
+    methods,
+    batched=False,
+    reference_xsteps=4000,
+    shift=0.0,
+    seed=1234,
+    n_pool=None,
+):
+    settings = dict(
+        parameters=parameters,
+        n_posterior=n_posterior,
+        batched=batched,
+        reference_xsteps=reference_xsteps,
+        shift=shift,
+        seed=seed,
+        n_pool=n_pool,
+    )
+    post_a, post_b = posterior_pair(n_posterior, seed=seed, shift=shift)
+
+    results = []
+    for parameter in parameters:
+        reference = reference_js(
+            post_a[parameter], post_b[parameter], parameter, reference_xsteps
+        )
+        print(f"{parameter}: reference JSD = {reference:.3e}")
+        for n, steps, tests, method in itertools.product(
+            n_samples, xsteps, n_tests, methods
+        ):
+            case = dict(
+                parameter=parameter,
+                n_samples=n,
+                xsteps=steps,
+                n_tests=tests,
+                method=method,
+            )
+            result = measure(
+                run_case,
+                **case,
+                batched=batched,
+                n_posterior=n_posterior,
+                seed=seed,
+                shift=shift,
+                n_pool=n_pool,
+            )
+            if "error" in result:
+                print(f"{case}: failed with {result['error']}")
+                results.append(dict(**case, **result))
+                continue
+            values = result.pop("output")
+            median, plus, minus = js.calc_median_error(values)
+            result.update(
+                reference=reference,
+                median=float(median),
+                plus=float(plus),
+                minus=float(minus),
+                abs_error=abs(float(median) - reference),
+            )
+            print(
+                f"  n_samples={n:<6d} xsteps={steps:<5d} n_tests={tests:<3d} "
+                f"{method:<5s} time={result['wall_time']:7.2f}s "
+                f"peak_rss={result['peak_rss']:7.1f}MB "
+                f"abs_error={result['abs_error']:.2e}"
+            )
+            results.append(dict(**case, **result))
+
+    write_results(output, settings, results)
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    main(
+        output=args.output,
+        parameters=args.parameters,
+        n_posterior=args.n_posterior,
+        n_samples=args.n_samples,
+        xsteps=args.xsteps,
+        n_tests=args.n_tests,
+        methods=args.methods,
+        batched=args.batched,
+        reference_xsteps=args.reference_xsteps,
+        shift=args.shift,
+        seed=args.seed,
+        n_pool=args.n_pool,
+    )
@@ -0,0 +1,97 @@
+"""
+Benchmark fitting and evaluating the KDEs on synthetic posteriors.
+
+For each parameter, number of samples, number of grid points and KDE method,
+this records the wall time and peak RSS for fitting the KDE and evaluating it
+on a grid, and the maximum relative error of the density compared to the
+exact KDE fitted to the same samples.
+"""
+
+import argparse
+import itertools
+
+import numpy as np
+from common import PARAMETERS, measure, posterior_pair, write_results
+
+from gw_smc_utils.kde import fit_kde
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", type=str, default="bench_kde.json")
+    parser.add_argument("--parameters", type=str, nargs="+", default=list(PARAMETERS))
+    parser.add_argument("--n-samples", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--xsteps", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--methods", type=str, nargs="+", default=["exact", "fft"])
+    parser.add_argument("--seed", type=int, default=1234)
+    return parser
+
+
+def _grid(samples, parameter, xsteps):
+    kwargs = PARAMETERS[parameter]
+    lower = kwargs["lower_bound"]
+    upper = kwargs["upper_bound"]
+    if lower is None:
+        lower = np.min(samples)
+    if upper is None:
+        upper = np.max(samples)
+    return np.linspace(lower, upper, xsteps)
+
+
+def _setup(parameter, n_samples, seed, **kwargs):
+    return posterior_pair(n_samples, seed=seed)[0][parameter]
+
+
+def run_case(samples, parameter, xsteps, method, **kwargs):
+    kde = fit_kde(samples, method=method, **PARAMETERS[parameter])
+    density = kde(_grid(samples, parameter, xsteps))
+    return [float(v) for v in density]
+
+
+run_case.setup = _setup
+
+
+def main(output, parameters, n_samples, xsteps, methods, seed=1234):
+    settings = dict(parameters=parameters, seed=seed)
+    results = []
+    for parameter in parameters:
+        print(f"{parameter}:")
+        for n, steps in itertools.product(n_samples, xsteps):
+            samples = posterior_pair(n, seed=seed)[0][parameter]
+            reference = fit_kde(samples, method="exact", **PARAMETERS[parameter])(
+                _grid(samples, parameter, steps)
+            )
+            for method in methods:
+                case = dict(
+                    parameter=parameter, n_samples=n, xsteps=steps, method=method
+                )
+                result = measure(run_case, **case, seed=seed)
+                if "error" in result:
+                    print(f"{case}: failed with {result['error']}")
+                    results.append(dict(**case, **result))
+                    continue
+                density = np.array(result.pop("output"))
+                result["max_rel_error"] = float(
+                    np.max(np.abs(density - reference)) / np.max(reference)
+                )
+                print(
+                    f"  n_samples={n:<6d} xsteps={steps:<5d} {method:<5s} "
+                    f"time={result['wall_time']:7.3f}s "
+                    f"peak_rss={result['peak_rss']:7.1f}MB "
+                    f"max_rel_error={result['max_rel_error']:.2e}"
+                )
+                results.append(dict(**case, **result))
+
+    write_results(output, settings, results)
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    main(
+        output=args.output,
+        parameters=args.parameters,
+        n_samples=args.n_samples,
+        xsteps=args.xsteps,
+        methods=args.methods,
+        seed=args.seed,
+    )
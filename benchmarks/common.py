@@ -0,0 +1,150 @@
+"""
+Shared utilities for the benchmarks: synthetic posteriors and measurements.
+"""
+
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+# Synthetic GW-like parameters covering each type of boundary
+PARAMETERS = {
+    "chirp_mass": dict(boundary_type="none", lower_bound=None, upper_bound=None),
+    "mass_ratio": dict(boundary_type="transform", lower_bound=0.125, upper_bound=1.0),
+    "a_1": dict(boundary_type="reflective", lower_bound=0.0, upper_bound=0.99),
+    "phase": dict(boundary_type="periodic", lower_bound=0.0, upper_bound=2 * np.pi),
+    "psi": dict(boundary_type="periodic", lower_bound=0.0, upper_bound=np.pi),
+}
+
+
+def synthetic_posterior(n, rng, shift=0.0):
+    """Draw a synthetic posterior with :code:`n` samples.
+
+    The distributions are chosen to resemble typical GW posteriors, e.g. a
+    mass ratio that piles up against :code:`q=1` and a spin magnitude that
+    piles up against zero. :code:`shift` perturbs every distribution, which
+    increases the JSD between two posteriors.
+    """
+    return {
+        "chirp_mass": rng.normal(30.0 + 0.1 * shift, 0.5, size=n),
+        "mass_ratio": 0.125 + 0.875 * rng.beta(5.0 + shift, 1.5, size=n),
+        "a_1": 0.99 * rng.beta(1.0, 3.0 + shift, size=n),
+        "phase": np.mod(rng.vonmises(1.0 + 0.1 * shift, 0.5, size=n), 2 * np.pi),
+        "psi": np.mod(rng.vonmises(0.5 * shift, 2.0, size=n), 2 * np.pi) / 2,
+    }
+
+
+def posterior_pair(n, seed=1234, shift=0.0):
+    """Draw two synthetic posteriors, the second with the given shift."""
+    rng = np.random.default_rng(seed)
+    return synthetic_posterior(n, rng), synthetic_posterior(n, rng, shift=shift)
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in MB."""
+    # On Linux, ru_maxrss is carried over from the parent when a process is
+    # spawned, whereas VmHWM only covers this process
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kB on Linux
+    if sys.platform == "darwin":
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+def warm_up():
+    """Compute a small JSD with each KDE method and type of boundary.
+
+    :code:`gw_smc_utils` imports pesummary, scipy.signal and scipy.spatial
+    the first time they are used, which takes longer than most of the cases
+    being measured.
+    """
+    from gw_smc_utils.js import calculate_js
+    from gw_smc_utils.kde import _known_kdes
+
+    _known_kdes()
+    post_a, post_b = posterior_pair(200, seed=0)
+    for parameter, kwargs in PARAMETERS.items():
+        for method in ["exact", "fft"]:
+            calculate_js(
+                post_a[parameter],
+                post_b[parameter],
+                n_tests=1,
+                xsteps=20,
+                n_samples=100,
+                rng=np.random.default_rng(0),
+                method=method,
+                **kwargs,
+            )
+
+
+def _run_child(queue, func, kwargs):
+    try:
+        warm_up()
+        setup = func.setup(**kwargs) if hasattr(func, "setup") else None
+        baseline = peak_rss()
+        start = time.perf_counter()
+        output = func(setup, **kwargs)
+        wall_time = time.perf_counter() - start
+        queue.put(
+            dict(
+                wall_time=wall_time,
+                peak_rss=peak_rss(),
+                baseline_rss=baseline,
+                output=output,
+            )
+        )
+    except Exception as e:
+        queue.put(dict(error=repr(e)))
+
+
+def measure(func, **kwargs):
+    """Run :code:`func(setup, **kwargs)` in a fresh process and return the
+    wall time, the peak RSS and the output.
+
+    Running each case in a new process means the peak RSS is not inflated by
+    earlier cases. If :code:`func` has a :code:`setup` attribute, it is
+    called first and its result passed to :code:`func`, so that neither the
+    time nor the baseline RSS include generating the inputs. The lazy
+    imports are also done before the timer starts, see :code:`warm_up`.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_child, args=(queue, func, kwargs))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def environment():
+    """Describe the machine, for comparing results between runs."""
+    import scipy
+
+    return dict(
+        python=platform.python_version(),
+        numpy=np.__version__,
+        scipy=scipy.__version__,
+        machine=platform.machine(),
+        processor=platform.processor(),
+        cpu_count=multiprocessing.cpu_count(),
+    )
+
+
+def write_results(filename, settings, results):
+    with open(filename, "w") as fp:
+        json.dump(
+            dict(environment=environment(), settings=settings, results=results),
+            fp,
+            indent=4,
+        )
@@ -6,13 +6,16 @@ Note this code is not optimized and may take several hours to run.
 
 import argparse
 import os
-import json
 import numpy as np
 from pathlib import Path
 import re
 from gw_smc_utils import js
-from gw_smc_utils.posterior import load_bilby_posterior
-from gw_smc_utils.utils import get_bilby_prior
+from gw_smc_utils.batch import JSDCheckpoint, checkpoint_path, is_complete, write_json
+from gw_smc_utils.catalog import ResultCatalog
+from gw_smc_utils.jsd_store import JSDStore, store_label
+from gw_smc_utils.kde import KDECache
+from gw_smc_utils.posterior import PosteriorCache, load_bilby_posterior
+from gw_smc_utils.utils import get_prior_summary
 
 
 def create_parser():
@@ -28,7 +31,80 @@ def create_parser():
     parser.add_argument("--verbose", action="store_true")
     parser.add_argument("--n-samples", type=int, default=5000)
     parser.add_argument("--n-tests", type=int, default=10)
+    parser.add_argument(
+        "--max-tests",
+        type=int,
+        default=None,
+        help=(
+            "If set, keep adding batches of n-tests replicates until the JSD "
+            "converges or max-tests is reached"
+        ),
+    )
     parser.add_argument("--n-pool", type=int, default=None)
+    parser.add_argument(
+        "--read-samples",
+        type=int,
+        default=None,
+        help=(
+            "If set, only read a reproducible random subset of this many "
+            "samples from each result file"
+        ),
+    )
+    parser.add_argument(
+        "--resample",
+        type=str,
+        default="choice",
+        choices=["choice", "vectorised", "bootstrap"],
+        help="How the subsets are drawn, see gw_smc_utils.js.calculate_js_many",
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        default="pickle",
+        choices=["pickle", "shared_memory", "memmap"],
+        help="How samples are sent to the pool, see gw_smc_utils.js.calculate_js_many",
+    )
+    parser.add_argument(
+        "--posterior-cache-dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory for caching the posteriors as memory-mappable arrays, "
+            "see gw_smc_utils.posterior.PosteriorCache"
+        ),
+    )
+    parser.add_argument(
+        "--kde-cache-dir",
+        type=str,
+        default=None,
+        help="Directory for caching KDE bandwidths and evaluations between runs",
+    )
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help=(
+            "Do not checkpoint after each parameter or skip pairs whose "
+            "output is already complete."
+        ),
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help=(
+            "HDF5 file to also add the results to, labelled by the output "
+            "file without the extension, see gw_smc_utils.jsd_store.JSDStore"
+        ),
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default=None,
+        help=(
+            "SQLite file used to index the result files, see "
+            "gw_smc_utils.catalog.ResultCatalog"
+        ),
+    )
     return parser
 
 
@@ -54,15 +130,19 @@ PARAMETERS = [
 ]
 
 
-def find_result_file_pairs(directory, samplers, prefix, run_labels):
+def find_result_file_pairs(directory, samplers, prefix, run_labels, catalog=None):
+    if catalog is not None:
+        catalog.refresh(directory)
     paths = {}
     for sampler, label in zip(samplers, run_labels):
         print(sampler, label)
-        paths[sampler] = list(
-            Path(directory).glob(
-                f"{prefix}*{sampler}*{label}/**/final_result/{sampler}*.hdf5"
+        pattern = f"{prefix}*{sampler}*{label}/**/final_result/{sampler}*.hdf5"
+        if catalog is not None:
+            paths[sampler] = catalog.glob(
+                os.path.join(directory, pattern.replace("/**/", "/*"))
             )
-        )
+        else:
+            paths[sampler] = list(Path(directory).glob(pattern))
     print(paths)
     labels = {}
     for i, sampler in enumerate(samplers):
@@ -112,7 +192,23 @@ def find_result_file_pairs(directory, samplers, prefix, run_labels):
 
 
 def compute_js(
-    result_files, filename, base, seed, verbose, n_samples, n_tests, n_pool, rng
+    result_files,
+    filename,
+    base,
+    seed,
+    verbose,
+    n_samples,
+    n_tests,
+    pool,
+    rng,
+    max_tests=None,
+    cache=None,
+    transport="pickle",
+    resample="choice",
+    read_samples=None,
+    posterior_cache=None,
+    checkpoint=True,
+    store=None,
 ):
     jsd = {
         "res1": str(result_files[0]),
@@ -120,65 +216,93 @@ def compute_js(
         "base": base,
         "seed": seed,
         "n_samples": n_samples,
+        "read_samples": read_samples,
         "n_tests": n_tests,
+        "max_tests": max_tests,
+        "resample": resample,
         "jsd": {},
     }
 
-    priors = get_bilby_prior(result_files[0])
-    priors_alt = get_bilby_prior(result_files[1])
+    priors = get_prior_summary(result_files[0])
+    priors_alt = get_prior_summary(result_files[1])
     if priors != priors_alt:
         raise ValueError("Priors are not the same")
 
-    post1 = load_bilby_posterior(result_files[0], PARAMETERS)
-    post2 = load_bilby_posterior(result_files[1], PARAMETERS)
+    post1 = load_bilby_posterior(
+        result_files[0],
+        PARAMETERS,
+        n_samples=read_samples,
+        seed=seed,
+        cache=posterior_cache,
+    )
+    post2 = load_bilby_posterior(
+        result_files[1],
+        PARAMETERS,
+        n_samples=read_samples,
+        seed=seed,
+        cache=posterior_cache,
+    )
 
-    if n_pool is not None:
-        from multiprocessing import Pool
+    spec = {}
+    for key in PARAMETERS:
+        if verbose:
+            if key not in post1:
+                print(f"Key {key} not found in post1, skipping")
+            else:
+                print(f"Calculating JSD for {key}")
 
-    else:
-        from multiprocessing.dummy import Pool
+        if key not in post1 or key not in post2:
+            continue
 
-        n_pool = 1
+        try:
+            boundary = priors[key].boundary
+        except KeyError:
+            continue
+        # These parameters are bounded but have zero prior probability at
+        # the boundary, so we can treat them as unbounded
+        if key in ["theta_jn", "tilt_1", "tilt_2", "dec"]:
+            boundary = "none"
+        spec[key] = dict(
+            lower_bound=priors[key].minimum,
+            upper_bound=priors[key].maximum,
+            boundary_type=boundary,
+        )
 
-    with Pool(n_pool) as pool:
-        for key in PARAMETERS:
-            if verbose:
-                if key not in post1:
-                    print(f"Key {key} not found in post1, skipping")
-                else:
-                    print(f"Calculating JSD for {key}")
-
-            if key not in post1 or key not in post2:
-                continue
+    completed = callback = None
+    if checkpoint:
+        checkpoint = JSDCheckpoint(checkpoint_path(filename), jsd, rng)
+        completed = checkpoint.jsd
+        callback = checkpoint.update
+        if completed:
+            print(f"Resuming {filename} from checkpoint with {list(completed)}")
 
-            try:
-                boundary = priors[key].boundary
-            except KeyError:
-                continue
-            # These parameters are bounded but have zero prior probability at
-            # the boundary, so we can treat them as unbounded
-            if key in ["theta_jn", "tilt_1", "tilt_2", "dec"]:
-                boundary = "none"
-
-            jsd["jsd"][key] = js.calculate_js(
-                post1[key],
-                post2[key],
-                base=base,
-                rng=rng,
-                lower_bound=priors[key].minimum,
-                upper_bound=priors[key].maximum,
-                boundary_type=boundary,
-                verbose=verbose,
-                n_samples=n_samples,
-                n_tests=n_tests,
-                pool=pool,
-            )
+    jsd["jsd"] = js.calculate_js_many(
+        post1,
+        post2,
+        spec,
+        base=base,
+        rng=rng,
+        verbose=verbose,
+        n_samples=n_samples,
+        n_tests=n_tests,
+        max_tests=max_tests,
+        pool=pool,
+        cache=cache,
+        transport=transport,
+        resample=resample,
+        completed=completed,
+        callback=callback,
+    )
+    jsd["n_tests_used"] = {key: len(value) for key, value in jsd["jsd"].items()}
 
     dir = os.path.split(filename)[0]
     os.makedirs(dir, exist_ok=True)
 
-    with open(filename, "w") as fp:
-        json.dump(jsd, fp, indent=4)
+    write_json(jsd, filename)
+    if checkpoint and os.path.exists(checkpoint.filename):
+        os.remove(checkpoint.filename)
+    if store is not None:
+        store.append({store_label(filename): jsd}, overwrite=True)
 
 
 def parse_label(label):
@@ -198,7 +322,16 @@ def main(
     verbose: bool = False,
     n_samples: int = 1000,
     n_tests: int = 10,
+    max_tests: int | None = None,
     n_pool: int | None = None,
+    kde_cache_dir: str | None = None,
+    transport: str = "pickle",
+    resample: str = "choice",
+    read_samples: int | None = None,
+    posterior_cache_dir: str | None = None,
+    catalog: str | None = None,
+    checkpoint: bool = True,
+    store: str | None = None,
 ):
     run_labels = [parse_label(label) for label in run_labels]
 
@@ -207,7 +340,11 @@ def main(
         print(result_file_pairs)
     else:
         result_file_pairs = find_result_file_pairs(
-            directory, samplers, prefix, run_labels
+            directory,
+            samplers,
+            prefix,
+            run_labels,
+            catalog=ResultCatalog(catalog) if catalog else None,
         )
         print(f"Found {len(result_file_pairs)} result file pairs")
     if not result_file_pairs:
@@ -216,21 +353,60 @@ def main(
 
     outdir.mkdir(parents=True, exist_ok=True)
 
-    for pair in result_file_pairs:
-        label, result_files = pair.popitem()
-        rng = np.random.default_rng(seed)
-        filename = outdir / f"{label}_jsd.json"
-        compute_js(
-            result_files=result_files,
-            filename=filename,
-            base=base,
-            seed=seed,
-            verbose=verbose,
-            n_samples=n_samples,
-            n_tests=n_tests,
-            n_pool=n_pool,
-            rng=rng,
-        )
+    cache = KDECache(directory=kde_cache_dir) if kde_cache_dir else None
+    posterior_cache = (
+        PosteriorCache(posterior_cache_dir) if posterior_cache_dir else None
+    )
+
+    if n_pool is not None:
+        from multiprocessing import Pool
+
+    else:
+        from multiprocessing.dummy import Pool
+
+        n_pool = 1
+
+    store = JSDStore(store) if store else None
+
+    # Use a single pool for all the result pairs
+    with Pool(n_pool) as pool:
+        for pair in result_file_pairs:
+            label, result_files = pair.popitem()
+            rng = np.random.default_rng(seed)
+            filename = outdir / f"{label}_jsd.json"
+            settings = dict(
+                res1=str(result_files[0]),
+                res2=str(result_files[1]),
+                base=base,
+                seed=seed,
+                n_samples=n_samples,
+                read_samples=read_samples,
+                n_tests=n_tests,
+                max_tests=max_tests,
+                resample=resample,
+            )
+            if checkpoint and is_complete(filename, settings):
+                print(f"Skipping {label}, {filename} is complete")
+                continue
+            compute_js(
+                result_files=result_files,
+                filename=filename,
+                base=base,
+                seed=seed,
+                verbose=verbose,
+                n_samples=n_samples,
+                n_tests=n_tests,
+                max_tests=max_tests,
+                pool=pool,
+                rng=rng,
+                cache=cache,
+                transport=transport,
+                resample=resample,
+                read_samples=read_samples,
+                posterior_cache=posterior_cache,
+                checkpoint=checkpoint,
+                store=store,
+            )
 
 
 if __name__ == "__main__":
@@ -245,5 +421,14 @@ if __name__ == "__main__":
         verbose=args.verbose,
         n_samples=args.n_samples,
         n_tests=args.n_tests,
+        max_tests=args.max_tests,
         n_pool=args.n_pool,
+        kde_cache_dir=args.kde_cache_dir,
+        transport=args.transport,
+        resample=args.resample,
+        read_samples=args.read_samples,
+        posterior_cache_dir=args.posterior_cache_dir,
+        catalog=args.catalog,
+        checkpoint=not args.no_checkpoint,
+        store=args.store,
     )
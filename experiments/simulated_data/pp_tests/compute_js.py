@@ -6,11 +6,18 @@ Note this code is not optimized and may take several hours to run.
 
 import argparse
 import os
-import json
-import numpy as np
-from gw_smc_utils import js
-from gw_smc_utils.posterior import load_bilby_posterior
-from gw_smc_utils.utils import get_bilby_prior
+from gw_smc_utils.batch import (
+    PARAMETERS,
+    checkpoint_path,
+    compute_pair_js,
+    js_spec,
+    write_json,
+)
+from gw_smc_utils.cli.batch_js import joint_pair
+from gw_smc_utils.jsd_store import JSDStore, store_label
+from gw_smc_utils.kde import KDECache
+from gw_smc_utils.posterior import PosteriorCache, load_bilby_posterior
+from gw_smc_utils.utils import get_prior_summary
 
 
 def create_parser():
@@ -22,35 +29,93 @@ def create_parser():
     parser.add_argument("--n-samples", type=int, default=5000)
     parser.add_argument("--xsteps", type=int, default=100)
     parser.add_argument("--n-tests", type=int, default=10)
+    parser.add_argument(
+        "--max-tests",
+        type=int,
+        default=None,
+        help=(
+            "If set, keep adding batches of n-tests replicates until the JSD "
+            "converges or max-tests is reached"
+        ),
+    )
     parser.add_argument("--n-pool", type=int, default=None)
+    parser.add_argument(
+        "--read-samples",
+        type=int,
+        default=None,
+        help=(
+            "If set, only read a reproducible random subset of this many "
+            "samples from each result file"
+        ),
+    )
+    parser.add_argument(
+        "--resample",
+        type=str,
+        default="choice",
+        choices=["choice", "vectorised", "bootstrap"],
+        help="How the subsets are drawn, see gw_smc_utils.js.calculate_js_many",
+    )
+    parser.add_argument(
+        "--transport",
+        type=str,
+        default="pickle",
+        choices=["pickle", "shared_memory", "memmap"],
+        help="How samples are sent to the pool, see gw_smc_utils.js.calculate_js_many",
+    )
+    parser.add_argument(
+        "--posterior-cache-dir",
+        type=str,
+        default=None,
+        help=(
+            "Directory for caching the posteriors as memory-mappable arrays, "
+            "see gw_smc_utils.posterior.PosteriorCache"
+        ),
+    )
+    parser.add_argument(
+        "--kde-cache-dir",
+        type=str,
+        default=None,
+        help="Directory for caching KDE bandwidths and evaluations between runs",
+    )
+    parser.add_argument(
+        "--no-checkpoint",
+        action="store_true",
+        help=(
+            "Do not write a checkpoint after each parameter. By default the "
+            "results are checkpointed to <filename>.checkpoint and a restarted "
+            "job resumes from the first missing parameter."
+        ),
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help=(
+            "HDF5 file to also add the result to, labelled by the filename "
+            "without the extension, see gw_smc_utils.jsd_store.JSDStore"
+        ),
+    )
+    parser.add_argument(
+        "--joint",
+        type=joint_pair,
+        nargs="+",
+        default=None,
+        help=(
+            "Pairs of parameters, e.g. chirp_mass,mass_ratio, for which to also "
+            "compute the JSD between the 2-D distributions"
+        ),
+    )
     parser.add_argument("--use-pesummary", action="store_true")
+    parser.add_argument(
+        "--kde-method",
+        type=str,
+        default="exact",
+        choices=["exact", "fft"],
+        help="Method used to evaluate the KDEs, see gw_smc_utils.kde.fit_kde",
+    )
     return parser
 
 
-PARAMETERS = [
-    "chirp_mass",
-    "mass_ratio",
-    "a_1",
-    "a_2",
-    "tilt_1",
-    "tilt_2",
-    "phi_12",
-    "phi_jl",
-    "luminosity_distance",
-    "dec",
-    "ra",
-    "theta_jn",
-    "psi",
-    "geocent_time",
-    "phase",
-    "zenith",
-    "azimuth",
-    "H1_time",
-    "L1_time",
-    "V1_time",
-]
-
-
 def main(
     result_files: list[str],
     filename: str,
@@ -59,101 +124,106 @@ def main(
     verbose: bool = False,
     n_samples: int = 1000,
     n_tests: int = 10,
+    max_tests: int | None = None,
     n_pool: int | None = None,
     use_pesummary: bool = False,
     xsteps: int = 100,
+    kde_method: str = "exact",
+    kde_cache_dir: str | None = None,
+    transport: str = "pickle",
+    resample: str = "choice",
+    read_samples: int | None = None,
+    posterior_cache_dir: str | None = None,
+    checkpoint: bool = True,
+    store: str | None = None,
+    joint: list[list[str]] | None = None,
 ):
-    os.makedirs("results", exist_ok=True)
+    cache = KDECache(directory=kde_cache_dir) if kde_cache_dir else None
+    posterior_cache = (
+        PosteriorCache(posterior_cache_dir) if posterior_cache_dir else None
+    )
 
-    rng = np.random.default_rng(seed)
+    if not use_pesummary:
+        if n_pool is not None:
+            from multiprocessing import Pool
+        else:
+            from multiprocessing.dummy import Pool
+
+            n_pool = 1
+
+        with Pool(n_pool) as pool:
+            jsd = compute_pair_js(
+                result_files,
+                PARAMETERS,
+                base=base,
+                seed=seed,
+                verbose=verbose,
+                n_samples=n_samples,
+                n_tests=n_tests,
+                max_tests=max_tests,
+                xsteps=xsteps,
+                kde_method=kde_method,
+                resample=resample,
+                read_samples=read_samples,
+                pool=pool,
+                cache=cache,
+                posterior_cache=posterior_cache,
+                transport=transport,
+                checkpoint=checkpoint_path(filename) if checkpoint else None,
+                joint=joint,
+            )
+        write_json(jsd, filename)
+        if checkpoint and os.path.exists(checkpoint_path(filename)):
+            os.remove(checkpoint_path(filename))
+        if store is not None:
+            JSDStore(store).append({store_label(filename): jsd}, overwrite=True)
+        return
+
+    print("Using pesummary for JSD calculation. This will ignore other settings")
+    from pesummary.utils.utils import jensen_shannon_divergence_from_samples
 
     jsd = {
         "res1": result_files[0],
         "res2": result_files[1],
         "base": base,
-        "seed": seed,
-        "n_samples": n_samples,
-        "n_tests": n_tests,
+        "seed": None,
+        "n_samples": None,
+        "read_samples": read_samples,
+        "n_tests": None,
+        "max_tests": None,
         "xsteps": xsteps,
         "use_pesummary": use_pesummary,
+        "kde_method": kde_method,
+        "resample": resample,
         "jsd": {},
     }
 
-    if verbose:
-        print(f"Settings: {jsd}")
-
-    if use_pesummary:
-        print("Using pesummary for JSD calculation. This will ignore other settings")
-        jsd["n_samples"] = None
-        jsd["n_tests"] = None
-        jsd["seed"] = None
-
-    priors = get_bilby_prior(result_files[0])
-    priors_alt = get_bilby_prior(result_files[1])
+    priors = get_prior_summary(result_files[0])
+    priors_alt = get_prior_summary(result_files[1])
     if priors != priors_alt:
         raise ValueError("Priors are not the same")
 
-    post1 = load_bilby_posterior(result_files[0], PARAMETERS)
-    post2 = load_bilby_posterior(result_files[1], PARAMETERS)
-
-    if n_pool is not None:
-        from multiprocessing import Pool
-
-    else:
-        from multiprocessing.dummy import Pool
-
-        n_pool = 1
-
-    with Pool(n_pool) as pool:
-        for key in PARAMETERS:
-            if verbose:
-                print(f"Calculating JSD for {key}")
-
-            if key not in post1:
-                print(f"Warning: {key} not in posterior A")
-                continue
-            if key not in post2:
-                print(f"Warning: {key} not in posterior B")
-                continue
-
-            if key not in priors:
-                print(f"Warning: {key} not in priors")
-                continue
-            boundary = priors[key].boundary
-            # These parameters are bounded but have zero prior probability at
-            # the boundary, so we can treat them as unbounded
-            if key in ["theta_jn", "tilt_1", "tilt_2", "dec"]:
-                boundary = "none"
-
-            if not use_pesummary:
-                jsd["jsd"][key] = js.calculate_js(
-                    post1[key],
-                    post2[key],
-                    base=base,
-                    rng=rng,
-                    lower_bound=priors[key].minimum,
-                    upper_bound=priors[key].maximum,
-                    boundary_type=boundary,
-                    verbose=verbose,
-                    n_samples=n_samples,
-                    n_tests=n_tests,
-                    pool=pool,
-                    xsteps=xsteps,
-                )
-            else:
-                from pesummary.utils.utils import jensen_shannon_divergence_from_samples
-
-                samples = [post1[key], post2[key]]
-                jsd["jsd"][key] = jensen_shannon_divergence_from_samples(
-                    samples=samples,
-                    base=base,
-                )
-
-    dir = os.path.split(filename)[0]
-    os.makedirs(dir, exist_ok=True)
-
-    with open(filename, "w") as fp:
-        json.dump(jsd, fp, indent=4)
+    post1, post2 = (
+        load_bilby_posterior(
+            filename,
+            PARAMETERS,
+            n_samples=read_samples,
+            seed=seed,
+            cache=posterior_cache,
+        )
+        for filename in result_files
+    )
+    for key in js_spec(priors, PARAMETERS, post1, post2):
+        if verbose:
+            print(f"Calculating JSD for {key}")
+        jsd["jsd"][key] = jensen_shannon_divergence_from_samples(
+            samples=[post1[key], post2[key]],
+            base=base,
+        )
+
+    write_json(jsd, filename)
+    if store is not None:
+        JSDStore(store).append({store_label(filename): jsd}, overwrite=True)
 
 
 if __name__ == "__main__":
@@ -165,7 +235,17 @@ if __name__ == "__main__":
         verbose=args.verbose,
         n_samples=args.n_samples,
         n_tests=args.n_tests,
+        max_tests=args.max_tests,
         n_pool=args.n_pool,
         use_pesummary=args.use_pesummary,
         xsteps=args.xsteps,
+        kde_method=args.kde_method,
+        kde_cache_dir=args.kde_cache_dir,
+        transport=args.transport,
+        resample=args.resample,
+        read_samples=args.read_samples,
+        posterior_cache_dir=args.posterior_cache_dir,
+        checkpoint=not args.no_checkpoint,
+        store=args.store,
+        joint=args.joint,
     )
@@ -9,37 +9,37 @@ files with the specified extension.
 
 import argparse
 import os
-import numpy as np
 import tqdm
 import pandas as pd
 from pathlib import Path
 from natsort import natsorted
 import json
 
-from bilby.core.result import read_in_result
-
+from gw_smc_utils.catalog import ResultCatalog
 from gw_smc_utils.plotting import set_style, pp_plot_from_credible_levels
-
-
-def get_injection_credible_level(result, parameter, injection_parameters, weights=None):
-    if weights is None:
-        weights = np.ones(len(result.posterior[parameter]))
-    if parameter not in injection_parameters:
-        raise ValueError(f"Parameter {parameter} not found in injections")
-    credible_level = np.sum(
-        np.array(result.posterior[parameter] < injection_parameters[parameter])
-        * weights
-    ) / np.sum(weights)
-    return credible_level
-
-
-def get_all_credible_levels(result, injection_parameters, keys, weights=None):
-    return {
-        key: get_injection_credible_level(
-            result, key, injection_parameters, weights=weights
-        )
-        for key in keys
-    }
+from gw_smc_utils.posterior import iter_bilby_posteriors
+from gw_smc_utils.pp import CredibleLevelsStore, compute_credible_levels
+
+
+def read_posteriors(result_files, keys, reader="posterior", n_workers=None):
+    """Yield the posterior from each result file.
+
+    With the :code:`"posterior"` reader only the required columns are read,
+    using several threads, whereas :code:`"bilby"` reads the full result
+    objects one at a time.
+    """
+    if reader == "bilby":
+        from bilby.core.result import read_in_result
+
+        for rf in result_files:
+            yield read_in_result(rf).posterior
+    elif reader == "posterior":
+        for _, posterior in iter_bilby_posteriors(
+            result_files, keys, n_workers=n_workers
+        ):
+            yield posterior
+    else:
+        raise ValueError(f"Unknown reader: {reader}")
 
 
 def get_parser():
@@ -86,10 +86,53 @@ def get_parser():
         default=False,
         help="Overwrite the credible levels file if it exists.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help=(
+            "Use the credible levels file as an incremental store and only "
+            "read the result files that are new or have changed. The file is "
+            "not compatible with the non-incremental mode."
+        ),
+    )
+    parser.add_argument(
+        "--reader",
+        type=str,
+        default="posterior",
+        choices=["posterior", "bilby"],
+        help=(
+            "How to read the result files, 'posterior' only reads the "
+            "required columns concurrently, 'bilby' uses read_in_result."
+        ),
+    )
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=None,
+        help="Number of threads for reading the result files.",
+    )
+    parser.add_argument(
+        "--catalog",
+        type=str,
+        default=None,
+        help=(
+            "SQLite file used to index the result files, only directories "
+            "that have changed since the last run are listed."
+        ),
+    )
     return parser
 
 
-def discover_result_files(result_dir, extension):
+def discover_result_files(result_dir, extension, catalog=None):
+    if catalog is not None:
+        catalog.refresh(result_dir)
+        return {
+            str(inj_id): str(path)
+            for inj_id, path in catalog.result_files(
+                directory=result_dir, extension=extension
+            ).items()
+        }
     result_files = {}
     for dirpath, _, filenames in os.walk(result_dir):
         if "final_result" in dirpath:
@@ -137,34 +180,53 @@ def main(args):
 
     credible_levels_filename = args.credible_levels_file
 
+    catalog = ResultCatalog(args.catalog) if args.catalog else None
+
     if credible_levels_filename is not None:
         credible_levels_filename = Path(credible_levels_filename)
         credible_levels_filename.parent.mkdir(exist_ok=True, parents=True)
 
-    if credible_levels_filename.exists() and not args.overwrite:
+    if args.incremental:
+        result_files = discover_result_files(
+            args.result_dir, args.extension, catalog=catalog
+        )
+        print(f"Found {len(result_files)} result files")
+        store = CredibleLevelsStore(credible_levels_filename, keys)
+        # Injection IDs are the indices of the injections
+        injections = {
+            inj_id: injection_parameters[int(inj_id)] for inj_id in result_files
+        }
+        updated = store.update(result_files, injections, n_workers=args.n_workers)
+        print(f"Computed credible levels for {len(updated)} new or changed results")
+        credible_levels = pd.DataFrame(
+            store.credible_levels(list(result_files)), index=list(result_files)
+        )
+    elif credible_levels_filename.exists() and not args.overwrite:
         print(f"Loading credible levels from {credible_levels_filename}")
         # Load credible levels from a file if provided
         credible_levels = pd.read_hdf(credible_levels_filename, key="credible_levels")
         if not set(keys).issubset(set(credible_levels.columns)):
             raise ValueError("Credible levels file does not contain all keys.")
     else:
-        result_files = discover_result_files(args.result_dir, args.extension)
+        result_files = discover_result_files(
+            args.result_dir, args.extension, catalog=catalog
+        )
 
         print(f"Found {len(result_files)} result files")
         print("Reading in results")
-        results = []
-        for rf in tqdm.tqdm(result_files.values()):
-            results.append(read_in_result(rf))
-        credible_levels = list()
-        for i, result in enumerate(results):
-            credible_levels.append(
-                get_all_credible_levels(
-                    result=result,
-                    injection_parameters=injection_parameters[i],
-                    keys=keys,
-                )
+        posteriors = read_posteriors(
+            list(result_files.values()),
+            keys,
+            reader=args.reader,
+            n_workers=args.n_workers,
+        )
+        credible_levels = pd.DataFrame(
+            compute_credible_levels(
+                tqdm.tqdm(posteriors, total=len(result_files)),
+                injection_parameters,
+                keys,
             )
-        credible_levels = pd.DataFrame(credible_levels)
+        )
         credible_levels.to_hdf(
             credible_levels_filename,
             key="credible_levels",
@@ -2,10 +2,11 @@
 
 import argparse
 from pathlib import Path
-import numpy as np
 import re
 import h5py
 
+from gw_smc_utils.summary import SCALARS, collect_run_summaries, summary_arrays
+
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -35,6 +36,12 @@ def get_parser():
     parser.add_argument(
         "--n-injections", type=int, default=100, help="Number of injections to process"
     )
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=None,
+        help="Number of threads for reading the result files",
+    )
     return parser
 
 
@@ -55,44 +62,39 @@ def main(args):
         n_injections = args.n_injections
 
         print(f"Producing for {sampler} with {det} in {path}")
-        data[sampler][det] = {
-            "sampling_time": np.nan * np.zeros(n_injections),
-            "likelihood_evaluations": np.nan * np.zeros(n_injections),
-            "n_samples": np.nan * np.zeros(n_injections),
-            "log_evidence": np.nan * np.zeros(n_injections),
-            "log_evidence_error": np.nan * np.zeros(n_injections),
-        }
+        manifest = {}
         for i in range(n_injections):
-            try:
-                result_file = next(
-                    (path / f"injection_{i}" / "final_result").glob("*.hdf5")
-                )
-            except StopIteration:
-                raise FileNotFoundError(
-                    f"No result file found for injection {i} in {path}"
-                )
-            with h5py.File(result_file, "r") as f:
-                if sampler == "dynesty":
-                    data[sampler][det]["sampling_time"][i] = f["sampling_time"][()]
-                data[sampler][det]["likelihood_evaluations"][i] = f[
-                    "num_likelihood_evaluations"
-                ][()]
-                data[sampler][det]["n_samples"][i] = len(f["posterior/mass_ratio"][()])
-                data[sampler][det]["log_evidence"][i] = f["log_evidence"][()]
-                data[sampler][det]["log_evidence_error"][i] = f["log_evidence_err"][()]
-
-            if "pocomc" in sampler:
+            manifest[i] = {
+                "result": path / f"injection_{i}" / "final_result" / "*.hdf5"
+            }
+            if sampler == "pocomc":
                 # Get the sampling time from the sampling_time.dat file
                 # This is a bit of a hack, but it works for now
-                try:
-                    timing_file = next(
-                        (path / f"injection_{i}" / "result").glob(
-                            "pocomc*/sampling_time.dat"
-                        )
-                    )
-                except StopIteration:
-                    continue
-                data[sampler][det]["sampling_time"][i] = np.loadtxt(timing_file)
+                manifest[i]["timing"] = (
+                    path / f"injection_{i}" / "result" / "pocomc*" / "sampling_time.dat"
+                )
+        scalars = dict(SCALARS)
+        if sampler == "pocomc":
+            scalars.pop("sampling_time")
+        summaries, missing = collect_run_summaries(
+            manifest,
+            n_workers=args.n_workers,
+            scalars=scalars,
+            posterior_key="mass_ratio",
+        )
+        for i, reason in missing.items():
+            print(f"Warning: injection {i} in {path}: {reason}")
+        data[sampler][det] = summary_arrays(
+            summaries,
+            range(n_injections),
+            names=[
+                "sampling_time",
+                "likelihood_evaluations",
+                "n_samples",
+                "log_evidence",
+                "log_evidence_error",
+            ],
+        )
 
     with h5py.File(args.output_dir / args.filename, "w") as f:
         for sampler, ndet_dict in data.items():
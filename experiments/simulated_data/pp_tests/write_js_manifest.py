@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Write the manifest of result file pairs for gw_smc_utils_batch_js.
+
+The paths follow the same pattern as `submit_js.sub`.
+"""
+
+import argparse
+
+
+def create_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", type=str, default="js_manifest.txt")
+    parser.add_argument("--n-injections", type=int, default=100)
+    parser.add_argument("--ndets", type=int, default=3)
+    parser.add_argument("--dets", type=str, default="H1L1V1")
+    parser.add_argument("--frame", type=str, default="det")
+    parser.add_argument("--dynesty-label", type=str, default="uniform_chirp_mass")
+    parser.add_argument(
+        "--pocomc-label", type=str, default="uniform_chirp_mass_transforms_sinf"
+    )
+    parser.add_argument(
+        "--outdir",
+        type=str,
+        default=(
+            "jsd_results/update_data/{pocomc_label}/{frame}_frame/"
+            "{ndets}det_max_min_xsteps"
+        ),
+    )
+    return parser
+
+
+def main(args):
+    settings = dict(
+        ndets=args.ndets,
+        dets=args.dets,
+        frame=args.frame,
+        dynesty_label=args.dynesty_label,
+        pocomc_label=args.pocomc_label,
+    )
+    outdir = args.outdir.format(**settings)
+    with open(args.output, "w") as fp:
+        for i in range(args.n_injections):
+            result1 = (
+                "outdir_dynesty_{ndets}det_{frame}_frame_{dynesty_label}/"
+                "injection_{i}/final_result/"
+                "dynesty_pp_test_data0_1364342674-0_analysis_{dets}_result.hdf5"
+            ).format(i=i, **settings)
+            result2 = (
+                "outdir_pocomc_{ndets}det_{frame}_frame_{pocomc_label}/"
+                "injection_{i}/final_result/"
+                "pococmc_pp_test_data0_1364342674-0_analysis_{dets}_result.hdf5"
+            ).format(i=i, **settings)
+            fp.write(f"{result1} {result2} {outdir}/data{i}.json\n")
+
+
+if __name__ == "__main__":
+    main(create_parser().parse_args())
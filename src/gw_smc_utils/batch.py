@@ -0,0 +1,547 @@
+"""
+Compute the JS divergence for many pairs of result files in a single job.
+"""
+
+import json
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .jsd_store import JSDStore, store_label
+
+# Parameters compared in the P-P test runs
+PARAMETERS = [
+    "chirp_mass",
+    "mass_ratio",
+    "a_1",
+    "a_2",
+    "tilt_1",
+    "tilt_2",
+    "phi_12",
+    "phi_jl",
+    "luminosity_distance",
+    "dec",
+    "ra",
+    "theta_jn",
+    "psi",
+    "geocent_time",
+    "phase",
+    "zenith",
+    "azimuth",
+    "H1_time",
+    "L1_time",
+    "V1_time",
+]
+
+# These parameters are bounded but have zero prior probability at the
+# boundary, so they are treated as unbounded
+UNBOUNDED = ("theta_jn", "tilt_1", "tilt_2", "dec")
+
+# Settings that must match for an existing output to be reused
+SETTINGS = (
+    "res1",
+    "res2",
+    "base",
+    "seed",
+    "n_samples",
+    "read_samples",
+    "n_tests",
+    "max_tests",
+    "xsteps",
+    "use_pesummary",
+    "kde_method",
+    "resample",
+    "joint",
+)
+
+
+def js_spec(priors, keys, posterior_a, posterior_b, unbounded=UNBOUNDED):
+    """Return the keyword arguments for :code:`fit_kde` for each parameter
+    that is in both posteriors and the priors.
+
+    Parameters
+    ----------
+    priors : gw_smc_utils.utils.PriorSummary
+        Priors for the runs.
+    keys : list[str]
+        Parameters to include.
+    posterior_a, posterior_b : dict
+        Posteriors for the two runs.
+    unbounded : tuple
+        Parameters to treat as unbounded regardless of the prior.
+    """
+    spec = {}
+    for key in keys:
+        if key not in posterior_a:
+            print(f"Warning: {key} not in posterior A")
+            continue
+        if key not in posterior_b:
+            print(f"Warning: {key} not in posterior B")
+            continue
+        if key not in priors:
+            print(f"Warning: {key} not in priors")
+            continue
+        boundary = priors[key].boundary
+        if key in unbounded:
+            boundary = "none"
+        spec[key] = dict(
+            lower_bound=priors[key].minimum,
+            upper_bound=priors[key].maximum,
+            boundary_type=boundary,
+        )
+    return spec
+
+
+def check_joint(joint):
+    """Check the pairs of parameters for the joint JSD and return them as
+    lists, as they are stored in the outputs.
+
+    Raises a ValueError unless each pair has exactly two different,
+    non-empty parameter names.
+    """
+    pairs = []
+    for pair in joint:
+        if isinstance(pair, str):
+            raise ValueError(f"Joint pair should be two parameters, got {pair!r}")
+        pair = list(pair)
+        if len(pair) != 2 or not all(pair) or pair[0] == pair[1]:
+            raise ValueError(
+                f"Joint pair should be two different parameters, got {pair}"
+            )
+        pairs.append(pair)
+    return pairs
+
+
+def compute_pair_js(
+    result_files,
+    parameters=None,
+    base=2,
+    seed=1234,
+    verbose=False,
+    n_samples=1000,
+    n_tests=10,
+    max_tests=None,
+    xsteps=100,
+    kde_method="exact",
+    resample="choice",
+    read_samples=None,
+    pool=None,
+    cache=None,
+    posterior_cache=None,
+    transport="pickle",
+    checkpoint=None,
+    joint=None,
+):
+    """Compute the JS divergence between two result files for each parameter.
+
+    Parameters
+    ----------
+    result_files : list[str]
+        The two result files.
+    parameters : list[str], optional
+        Parameters to compare, defaults to :code:`PARAMETERS`.
+    pool : multiprocessing.Pool, optional
+        Pool used for the replicates, see
+        :code:`gw_smc_utils.js.calculate_js_many`.
+    cache : gw_smc_utils.kde.KDECache, optional
+        Cache for the KDEs.
+    posterior_cache : gw_smc_utils.posterior.PosteriorCache, optional
+        Cache for the posteriors.
+    checkpoint : str, optional
+        File for a per-parameter checkpoint, see :code:`JSDCheckpoint`. If
+        the file exists and has the same settings, the parameters it
+        contains are not recomputed and the result is identical to an
+        uninterrupted run. The file is not removed, this should be done
+        once the result has been written.
+    joint : list, optional
+        Pairs of parameters, e.g. :code:`[("chirp_mass", "mass_ratio")]`,
+        for which to also compute the JS divergence between the 2-D
+        distributions using :code:`gw_smc_utils.js.calculate_js_2d`. The
+        results are stored under :code:`"<a>,<b>"`. The pairs are checked
+        with :code:`check_joint` before anything is computed. These always use
+        :code:`n_tests` replicates and their own random number generators,
+        so the results for the individual parameters do not change.
+
+    The other arguments are the same as :code:`calculate_js_many`.
+
+    Returns
+    -------
+    dict
+        Dictionary with the settings, the JS divergences for each parameter,
+        :code:`"jsd"`, and the number of replicates used for each
+        parameter, :code:`"n_tests_used"`.
+    """
+    from .js import calculate_js_2d, calculate_js_many
+    from .posterior import load_bilby_posterior
+    from .utils import get_prior_summary
+
+    if parameters is None:
+        parameters = PARAMETERS
+
+    jsd = {
+        "res1": str(result_files[0]),
+        "res2": str(result_files[1]),
+        "base": base,
+        "seed": seed,
+        "n_samples": n_samples,
+        "read_samples": read_samples,
+        "n_tests": n_tests,
+        "max_tests": max_tests,
+        "xsteps": xsteps,
+        "use_pesummary": False,
+        "kde_method": kde_method,
+        "resample": resample,
+        "jsd": {},
+    }
+    if joint:
+        jsd["joint"] = check_joint(joint)
+    if verbose:
+        print(f"Settings: {jsd}")
+
+    priors = get_prior_summary(result_files[0])
+    if priors != get_prior_summary(result_files[1]):
+        raise ValueError("Priors are not the same")
+
+    posteriors = [
+        load_bilby_posterior(
+            filename,
+            parameters,
+            n_samples=read_samples,
+            seed=seed,
+            cache=posterior_cache,
+        )
+        for filename in result_files
+    ]
+    spec = js_spec(priors, parameters, *posteriors)
+    if verbose:
+        print(f"Calculating JSD for {list(spec)}")
+
+    rng = np.random.default_rng(seed)
+    completed = callback = None
+    if checkpoint is not None:
+        checkpoint = JSDCheckpoint(checkpoint, jsd, rng)
+        completed = checkpoint.jsd
+        callback = checkpoint.update
+        if completed and verbose:
+            print(f"Resuming from checkpoint with {list(completed)}")
+
+    jsd["jsd"] = calculate_js_many(
+        *posteriors,
+        spec,
+        base=base,
+        rng=rng,
+        verbose=verbose,
+        n_samples=n_samples,
+        n_tests=n_tests,
+        max_tests=max_tests,
+        pool=pool,
+        xsteps=xsteps,
+        method=kde_method,
+        cache=cache,
+        transport=transport,
+        resample=resample,
+        completed=completed,
+        callback=callback,
+    )
+    for i, (a, b) in enumerate(jsd.get("joint", [])):
+        key = f"{a},{b}"
+        if a not in spec or b not in spec:
+            print(f"Warning: cannot compute the joint JSD for {key}, skipping")
+            continue
+        if completed and key in completed:
+            jsd["jsd"][key] = completed[key]
+            continue
+        if verbose:
+            print(f"Calculating joint JSD for {key}")
+        jsd["jsd"][key] = calculate_js_2d(
+            *[
+                np.column_stack([posterior[a], posterior[b]])
+                for posterior in posteriors
+            ],
+            n_tests=n_tests,
+            xsteps=xsteps,
+            n_samples=n_samples,
+            base=base,
+            rng=np.random.default_rng([seed, i]),
+            pool=pool,
+            resample=resample,
+            boundary_type=(spec[a]["boundary_type"], spec[b]["boundary_type"]),
+            lower_bound=(spec[a]["lower_bound"], spec[b]["lower_bound"]),
+            upper_bound=(spec[a]["upper_bound"], spec[b]["upper_bound"]),
+        )
+        if callback is not None:
+            callback(key, jsd["jsd"][key])
+    jsd["n_tests_used"] = {key: len(value) for key, value in jsd["jsd"].items()}
+    return jsd
+
+
+def write_json(data, filename):
+    """Write a dictionary to a JSON file atomically, so the file is either
+    complete or missing."""
+    directory = os.path.dirname(os.path.abspath(filename))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(data, fp, indent=4)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class JSDCheckpoint:
+    """Per-parameter checkpoint for the JS divergence between two result
+    files.
+
+    The checkpoint contains the settings, the initial state of the random
+    number generator and the JS divergences for each parameter that has
+    finished. It is rewritten atomically after every parameter, so it is
+    always valid even if the job is killed. A checkpoint with different
+    settings or random state is ignored.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the checkpoint file.
+    settings : dict
+        Settings for the calculation. The :code:`"jsd"` entry, if present,
+        is ignored.
+    rng : numpy.random.Generator
+        Random number generator before any subsets have been drawn.
+    """
+
+    def __init__(self, filename, settings, rng):
+        self.filename = str(filename)
+        self.settings = {k: v for k, v in settings.items() if k != "jsd"}
+        self.rng_state = rng.bit_generator.state
+        self.jsd = self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename) as fp:
+                data = json.load(fp)
+        except (OSError, ValueError):
+            return {}
+        # Compare after a round trip through JSON, e.g. tuples become lists
+        expected = json.loads(
+            json.dumps(dict(settings=self.settings, rng_state=self.rng_state))
+        )
+        if (
+            data.get("settings") != expected["settings"]
+            or data.get("rng_state") != expected["rng_state"]
+        ):
+            print(f"Ignoring checkpoint {self.filename} with different settings")
+            return {}
+        return data.get("jsd", {})
+
+    def update(self, key, values):
+        """Add the values for a parameter and rewrite the checkpoint."""
+        self.jsd[key] = [float(v) for v in values]
+        write_json(
+            dict(settings=self.settings, rng_state=self.rng_state, jsd=self.jsd),
+            self.filename,
+        )
+
+
+def checkpoint_path(filename):
+    """Path to the checkpoint for an output file."""
+    return f"{filename}.checkpoint"
+
+
+def is_complete(filename, settings):
+    """Check if an output file exists, contains the results for every
+    parameter and was computed with the given settings."""
+    try:
+        with open(filename) as fp:
+            jsd = json.load(fp)
+    except (OSError, ValueError):
+        return False
+    if "n_tests_used" not in jsd:
+        return False
+    return all(jsd.get(key) == settings[key] for key in SETTINGS if key in settings)
+
+
+def read_manifest(filename):
+    """Read a manifest of pairs of result files.
+
+    Each line contains the two result files and the output file separated by
+    whitespace. Blank lines and lines starting with :code:`#` are ignored.
+
+    Returns
+    -------
+    list
+        List of :code:`(result_a, result_b, output)` tuples.
+    """
+    manifest = []
+    with open(filename) as fp:
+        for i, line in enumerate(fp, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = line.split()
+            if len(entry) != 3:
+                raise ValueError(
+                    f"Line {i} of {filename} should contain two result files "
+                    f"and an output file, got: {line}"
+                )
+            manifest.append(tuple(entry))
+    return manifest
+
+
+_worker_state = {}
+
+
+def _init_worker(kde_cache_dir, posterior_cache_dir):
+    """Create the caches once per worker so they are reused for every pair
+    it computes."""
+    from .kde import KDECache
+    from .posterior import PosteriorCache
+
+    _worker_state["cache"] = (
+        KDECache(directory=kde_cache_dir) if kde_cache_dir else None
+    )
+    _worker_state["posterior_cache"] = (
+        PosteriorCache(posterior_cache_dir) if posterior_cache_dir else None
+    )
+
+
+def _run_pair(result_a, result_b, output, kwargs):
+    checkpoint = checkpoint_path(output)
+    jsd = compute_pair_js(
+        [result_a, result_b], checkpoint=checkpoint, **_worker_state, **kwargs
+    )
+    write_json(jsd, output)
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return jsd
+
+
+def _pair_cost(entry):
+    """Estimate the cost of a pair from the size of the result files."""
+    return sum(os.path.getsize(f) if os.path.exists(f) else 0 for f in entry[:2])
+
+
+def run_batch(
+    manifest,
+    n_workers=None,
+    kde_cache_dir=None,
+    posterior_cache_dir=None,
+    overwrite=False,
+    store=None,
+    **kwargs,
+):
+    """Compute the JS divergence for every pair in a manifest using a single
+    pool of processes.
+
+    Each pair is computed by one worker and the workers take the next pair
+    as soon as they finish, so the load is balanced even if the pairs take
+    different amounts of time. The pairs are started in order of decreasing
+    file size so that the slowest pairs do not run last. Each output is
+    written atomically as soon as it is complete, so an interrupted batch can
+    be resumed by running it again: outputs that already exist with the same
+    settings are skipped and pairs that were interrupted resume from their
+    per-parameter checkpoint.
+
+    Parameters
+    ----------
+    manifest : list
+        List of :code:`(result_a, result_b, output)` tuples, see
+        :code:`read_manifest`.
+    n_workers : int, optional
+        Number of processes, defaults to the number of CPUs.
+    kde_cache_dir, posterior_cache_dir : str, optional
+        Directories for the KDE and posterior caches shared by the workers.
+    overwrite : bool
+        If True, recompute every pair even if the output is complete.
+    store : gw_smc_utils.jsd_store.JSDStore or str, optional
+        Store to add each result to as soon as it is complete, labelled by
+        the output file without the extension.
+
+    Other keyword arguments are passed to :code:`compute_pair_js`, except
+    for the arguments set by the driver: :code:`result_files`, the caches,
+    which are created in each worker from :code:`kde_cache_dir` and
+    :code:`posterior_cache_dir`, the :code:`checkpoint`, which is next to
+    each output, and the :code:`pool`, since each pair runs in one worker.
+
+    Returns
+    -------
+    completed : list
+        Outputs that were written.
+    skipped : list
+        Outputs that were already complete.
+    failed : dict
+        Dictionary mapping each output that could not be computed to the
+        error.
+    """
+    reserved = {
+        "result_files": "the manifest",
+        "cache": "kde_cache_dir",
+        "posterior_cache": "posterior_cache_dir",
+        "checkpoint": "the output files",
+        "pool": "n_workers",
+    }
+    for key in sorted(reserved.keys() & kwargs.keys()):
+        raise TypeError(
+            f"run_batch() sets the {key!r} argument of compute_pair_js from "
+            f"{reserved[key]}, it cannot be passed directly"
+        )
+    defaults = dict(
+        base=2,
+        seed=1234,
+        n_samples=1000,
+        read_samples=None,
+        n_tests=10,
+        max_tests=None,
+        xsteps=100,
+        use_pesummary=False,
+        kde_method="exact",
+        resample="choice",
+        joint=None,
+    )
+    if kwargs.get("joint"):
+        # Compare with the outputs, where the pairs are lists
+        kwargs["joint"] = check_joint(kwargs["joint"])
+    todo = []
+    skipped = []
+    for entry in manifest:
+        settings = {**defaults, **kwargs, "res1": entry[0], "res2": entry[1]}
+        if not overwrite and is_complete(entry[2], settings):
+            skipped.append(entry[2])
+        else:
+            todo.append(entry)
+    todo.sort(key=_pair_cost, reverse=True)
+    if store is not None and not isinstance(store, JSDStore):
+        store = JSDStore(store)
+    print(f"Computing {len(todo)} pairs, skipping {len(skipped)} complete pairs")
+
+    completed = []
+    failed = {}
+    with ProcessPoolExecutor(
+        n_workers,
+        initializer=_init_worker,
+        initargs=(kde_cache_dir, posterior_cache_dir),
+    ) as executor:
+        pending = {
+            executor.submit(_run_pair, *entry, kwargs): entry[2] for entry in todo
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                output = pending.pop(future)
+                try:
+                    jsd = future.result()
+                except Exception as e:
+                    print(f"Failed to compute {output}: {e!r}")
+                    failed[output] = repr(e)
+                else:
+                    if store is not None:
+                        store.append({store_label(output): jsd}, overwrite=True)
+                    completed.append(output)
+                    print(
+                        f"Finished {output} "
+                        f"({len(completed) + len(failed)}/{len(todo)})"
+                    )
+    return completed, skipped, failed
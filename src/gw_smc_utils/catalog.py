@@ -0,0 +1,298 @@
+"""
+Persistent index of result files and GWTC data release files.
+"""
+
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+SAMPLERS = ("dynesty", "pocomc")
+
+# Incremented when the metadata stored for each file changes, a catalog
+# with a different version is rebuilt
+_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT,
+    kind TEXT,
+    sampler TEXT,
+    n_det TEXT,
+    run TEXT,
+    label TEXT,
+    injection_id INTEGER,
+    event TEXT,
+    release TEXT,
+    cosmo INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE INDEX IF NOT EXISTS files_kind ON files (kind, sampler, n_det);
+CREATE INDEX IF NOT EXISTS files_event ON files (event);
+"""
+
+_GWTC_PATTERN = re.compile(r".*?-(GW\d{6}(?:_\d{6})?)_.*?(nocosmo|cosmo)\.h5$")
+_INJECTION_PATTERN = re.compile(r"injection_(\d+)$")
+_N_DET_PATTERN = re.compile(r"\d+det")
+
+
+def parse_path(path, samplers=SAMPLERS):
+    """Extract the metadata for a file from its path.
+
+    Result files are the files in a :code:`final_result` directory. The sampler and number of detectors are taken from the name
+    of the run directory, e.g. :code:`outdir_pocomc_3det_label`, and the
+    injection ID from an :code:`injection_<id>` directory. GWTC files are
+    named :code:`*-<event>_*[no]cosmo.h5` and the release is the name of the
+    directory containing them.
+
+    Returns None if the file is neither a result file nor a GWTC file.
+    """
+    path = Path(path)
+    match = _GWTC_PATTERN.match(path.name)
+    if match is not None:
+        return dict(
+            kind="gwtc",
+            event=match.group(1),
+            release=path.parent.name,
+            cosmo=int(match.group(2) == "cosmo"),
+        )
+    if "final_result" not in path.parts[:-1]:
+        return None
+
+    metadata = dict(kind="result")
+    for part in reversed(path.parts[:-1]):
+        match = _INJECTION_PATTERN.search(part)
+        if match is not None and "injection_id" not in metadata:
+            metadata["injection_id"] = int(match.group(1))
+        sampler = next((s for s in samplers if s in part), None)
+        if sampler is not None and part != path.name:
+            metadata.update(sampler=sampler, run=part)
+            n_det = _N_DET_PATTERN.search(part)
+            if n_det is not None:
+                metadata["n_det"] = n_det.group(0)
+                label = part.split(sampler)[-1].split(n_det.group(0))[-1]
+                metadata["label"] = label.strip("_")
+            break
+    return metadata
+
+
+class ResultCatalog:
+    """Index of result files and GWTC data release files stored in SQLite.
+
+    The catalog records the modification time of every directory it has
+    scanned. When it is refreshed, only directories whose modification time
+    has changed are listed again, so refreshing a large tree that has not
+    changed only costs one :code:`stat` per directory. Files that are
+    modified in place without being renamed are not detected.
+
+    GWTC events can be found by their full name, e.g.
+    :code:`GW150914_095045`, or by the short name, e.g. :code:`GW150914`.
+
+    Parameters
+    ----------
+    database : str
+        Path to the SQLite database, created if it does not exist.
+    samplers : tuple
+        Names of the samplers to look for in the run directories.
+    """
+
+    def __init__(self, database, samplers=SAMPLERS):
+        self.database = database
+        self.samplers = tuple(samplers)
+        self._connection = sqlite3.connect(database)
+        (version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if version != _VERSION:
+            self._connection.executescript(
+                "DROP TABLE IF EXISTS directories; DROP TABLE IF EXISTS files;"
+            )
+            self._connection.execute(f"PRAGMA user_version = {_VERSION}")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def refresh(self, *roots):
+        """Scan the given directories, listing only those that have changed
+        since the last refresh.
+
+        Returns the number of directories that were listed.
+        """
+        db = self._connection
+        n_listed = 0
+        with db:
+            stack = [os.path.abspath(root) for root in roots]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    self._remove(directory)
+                    continue
+                row = db.execute(
+                    "SELECT mtime_ns FROM directories WHERE path = ?", (directory,)
+                ).fetchone()
+                if row is not None and row[0] == mtime:
+                    stack.extend(
+                        path
+                        for (path,) in db.execute(
+                            "SELECT path FROM directories WHERE parent = ?",
+                            (directory,),
+                        )
+                    )
+                    continue
+                n_listed += 1
+                stack.extend(self._list(directory, mtime))
+        return n_listed
+
+    def _list(self, directory, mtime):
+        db = self._connection
+        subdirectories = []
+        files = []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.is_file():
+                    metadata = parse_path(entry.path, self.samplers)
+                    if metadata is not None:
+                        files.append((entry.path, metadata))
+
+        # Remove subdirectories that no longer exist
+        known = {
+            path
+            for (path,) in db.execute(
+                "SELECT path FROM directories WHERE parent = ?", (directory,)
+            )
+        }
+        for path in known.difference(subdirectories):
+            self._remove(path)
+
+        db.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        db.executemany(
+            "INSERT INTO files (path, directory, kind, sampler, n_det, run, label, "
+            "injection_id, event, release, cosmo) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    path,
+                    directory,
+                    m["kind"],
+                    m.get("sampler"),
+                    m.get("n_det"),
+                    m.get("run"),
+                    m.get("label"),
+                    m.get("injection_id"),
+                    m.get("event"),
+                    m.get("release"),
+                    m.get("cosmo"),
+                )
+                for path, m in files
+            ],
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO directories (path, parent, mtime_ns) "
+            "VALUES (?, ?, ?)",
+            (directory, os.path.dirname(directory), mtime),
+        )
+        # Subdirectories start without a modification time so they are listed
+        for path in subdirectories:
+            db.execute(
+                "INSERT OR IGNORE INTO directories (path, parent, mtime_ns) "
+                "VALUES (?, ?, NULL)",
+                (path, directory),
+            )
+        return subdirectories
+
+    def _remove(self, directory):
+        """Remove a directory and everything below it from the catalog."""
+        prefix = directory.rstrip(os.sep) + os.sep
+        db = self._connection
+        for table, column in [("directories", "path"), ("files", "directory")]:
+            db.execute(
+                f"DELETE FROM {table} WHERE {column} = ? OR substr({column}, 1, ?) = ?",
+                (directory, len(prefix), prefix),
+            )
+
+    def find(self, **criteria):
+        """Return the paths of the files matching the given metadata, e.g.
+        :code:`kind="result"`, :code:`sampler="pocomc"`, :code:`n_det="3det"`,
+        :code:`label`, :code:`injection_id`, :code:`event`, :code:`release`
+        or :code:`cosmo`. A :code:`directory` criterion restricts the search
+        to files below that directory. An event without the time, e.g.
+        :code:`GW150914`, also matches the full name, e.g.
+        :code:`GW150914_095045`, as with the glob in
+        :code:`gw_smc_utils.results.find_gwtc_results`."""
+        columns = {
+            "kind",
+            "sampler",
+            "n_det",
+            "run",
+            "label",
+            "injection_id",
+            "event",
+            "release",
+            "cosmo",
+        }
+        clauses = []
+        values = []
+        directory = criteria.pop("directory", None)
+        if directory is not None:
+            prefix = os.path.abspath(directory).rstrip(os.sep) + os.sep
+            clauses.append("substr(path, 1, ?) = ?")
+            values.extend([len(prefix), prefix])
+        for key, value in criteria.items():
+            if key not in columns:
+                raise ValueError(f"Unknown criterion: {key}")
+            if key == "cosmo" and value is not None:
+                value = int(value)
+            if key == "event" and value is not None:
+                clauses.append("(event = ? OR event GLOB ?)")
+                values.extend([value, f"{value}_*"])
+                continue
+            clauses.append(f"{key} IS ?")
+            values.append(value)
+        query = "SELECT path FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY path"
+        return [Path(path) for (path,) in self._connection.execute(query, values)]
+
+    def glob(self, pattern):
+        """Return the paths matching a glob pattern.
+
+        This uses SQLite's :code:`GLOB`, in which :code:`*` also matches
+        :code:`/`, so it is slightly more permissive than :code:`Path.glob`.
+        """
+        pattern = os.path.abspath(pattern)
+        return [
+            Path(path)
+            for (path,) in self._connection.execute(
+                "SELECT path FROM files WHERE path GLOB ? ORDER BY path", (pattern,)
+            )
+        ]
+
+    def result_files(self, directory=None, extension="hdf5", **criteria):
+        """Return a dictionary mapping the injection ID to the result file
+        for the result files matching the criteria whose names end with
+        :code:`extension`."""
+        paths = self.find(kind="result", directory=directory, **criteria)
+        result_files = {}
+        for path in paths:
+            if not path.name.endswith(extension):
+                continue
+            metadata = parse_path(path, self.samplers)
+            if metadata.get("injection_id") is not None:
+                result_files[metadata["injection_id"]] = path
+        return dict(sorted(result_files.items()))
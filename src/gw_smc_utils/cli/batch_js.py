@@ -0,0 +1,111 @@
+"""
+Compute the JS divergence for every pair of result files in a manifest.
+
+Each line of the manifest contains the two result files and the output JSON
+file, e.g. the :code:`result1`, :code:`result2` and :code:`filename` from
+:code:`submit_js.sub`. All the pairs are computed in one pool of processes
+and outputs that are already complete are skipped, so the same command can
+be used to resume an interrupted batch.
+"""
+
+import argparse
+import sys
+
+
+def joint_pair(value):
+    """Parse a pair of parameters for the joint JSD, e.g.
+    :code:`chirp_mass,mass_ratio`."""
+    pair = value.split(",")
+    if len(pair) != 2 or not all(pair) or pair[0] == pair[1]:
+        raise argparse.ArgumentTypeError(
+            f"expected two different parameters separated by a comma, got {value!r}"
+        )
+    return pair
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("manifest", type=str)
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=None,
+        help="Number of processes, defaults to the number of CPUs.",
+    )
+    parser.add_argument("--base", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--n-samples", type=int, default=5000)
+    parser.add_argument("--xsteps", type=int, default=100)
+    parser.add_argument("--n-tests", type=int, default=10)
+    parser.add_argument("--max-tests", type=int, default=None)
+    parser.add_argument("--read-samples", type=int, default=None)
+    parser.add_argument(
+        "--resample",
+        type=str,
+        default="choice",
+        choices=["choice", "vectorised", "bootstrap"],
+    )
+    parser.add_argument(
+        "--kde-method",
+        type=str,
+        default="exact",
+        choices=["exact", "fft"],
+    )
+    parser.add_argument(
+        "--joint",
+        type=joint_pair,
+        nargs="+",
+        default=None,
+        help=(
+            "Pairs of parameters, e.g. chirp_mass,mass_ratio, for which to also "
+            "compute the JSD between the 2-D distributions"
+        ),
+    )
+    parser.add_argument("--kde-cache-dir", type=str, default=None)
+    parser.add_argument("--posterior-cache-dir", type=str, default=None)
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="HDF5 file to add each result to, see gw_smc_utils.jsd_store.JSDStore",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Recompute pairs whose output is already complete.",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+
+    from gw_smc_utils.batch import read_manifest, run_batch
+
+    manifest = read_manifest(args.manifest)
+    _, _, failed = run_batch(
+        manifest,
+        n_workers=args.n_workers,
+        kde_cache_dir=args.kde_cache_dir,
+        posterior_cache_dir=args.posterior_cache_dir,
+        overwrite=args.overwrite,
+        store=args.store,
+        base=args.base,
+        seed=args.seed,
+        verbose=args.verbose,
+        n_samples=args.n_samples,
+        n_tests=args.n_tests,
+        max_tests=args.max_tests,
+        xsteps=args.xsteps,
+        kde_method=args.kde_method,
+        resample=args.resample,
+        read_samples=args.read_samples,
+        joint=args.joint,
+    )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,11 @@
 import argparse
-from pesummary.io import read as pesummary_read
-from pesummary.utils.samples_dict import MultiAnalysisSamplesDict
-import matplotlib.pyplot as plt
 import numpy as np
 from pathlib import Path
 
+from gw_smc_utils.js import calculate_js_matrix
 from gw_smc_utils.results import find_gwtc_results
 from gw_smc_utils.plotting import set_style
 
-set_style()
-
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -37,6 +33,13 @@ def main():
     parser = get_parser()
     args = parser.parse_args()
 
+    # Imported here so that the parser does not need to wait for them
+    import matplotlib.pyplot as plt
+    from pesummary.io import read as pesummary_read
+    from pesummary.utils.samples_dict import MultiAnalysisSamplesDict
+
+    set_style()
+
     np.random.seed(args.seed)
 
     filepath, release = find_gwtc_results(
@@ -100,10 +103,22 @@ def main():
             )
 
             for i, parameter in enumerate(parameters):
-                jsd_base_e = samples.js_divergence(parameter)
-                jsd_base_2 = jsd_base_e / np.log(2) * 1000
-                print(f"{parameter}: {jsd_base_2} mbits")
-                axs[i, i].set_title(f"{jsd_base_2:.2f} mbits", fontsize=20)
+                # Each KDE is fitted once and compared with all the others
+                jsd = calculate_js_matrix(
+                    {label: samples[label][parameter] for label in samples},
+                    n_tests=1,
+                    n_samples=None,
+                    xsteps=100,
+                    base=2,
+                    rng=np.random.default_rng(args.seed),
+                    boundary_type="none",
+                )
+                jsd_mbits = 1000 * jsd.median
+                for j, label in enumerate(jsd.labels[1:], start=1):
+                    print(
+                        f"{parameter}: {jsd_mbits[0, j]} mbits ({release} vs {label})"
+                    )
+                axs[i, i].set_title(f"{jsd_mbits[0, 1]:.2f} mbits", fontsize=20)
             plt.savefig(
                 output / f"{args.SID}_{key}.{args.extension}", bbox_inches="tight"
             )
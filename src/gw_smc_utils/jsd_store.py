@@ -0,0 +1,252 @@
+"""
+Single-file store for the JS divergences between many pairs of results.
+"""
+
+import fcntl
+import glob
+import json
+import os
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+
+# Entries in a result dictionary that are not settings
+_NOT_SETTINGS = ("jsd", "n_tests_used")
+
+
+class JSDStore:
+    """Store for the JS divergences between many pairs of result files.
+
+    Every replicate for each (pair, parameter) is stored as a row of a
+    long-format table in a single HDF5 file, so loading the results for
+    thousands of pairs only requires reading a few arrays. The settings for
+    each pair, e.g. the seed and number of samples, are stored as JSON next
+    to its label.
+
+    Appending takes an exclusive lock on :code:`<filename>.lock`, so
+    several jobs can append to the same store. The rows are appended in
+    place, so a job that is killed while appending can leave the file
+    corrupted. The per-pair JSON files should be kept, and the store can be
+    rebuilt from them with :code:`import_json`. Results are labelled by the
+    path of their JSON file without the extension, see :code:`store_label`.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the HDF5 file, created on the first append.
+    """
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+
+    @contextmanager
+    def _lock(self, exclusive):
+        with open(f"{self.filename}.lock", "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def labels(self):
+        """Return the labels of the pairs in the store."""
+        if not os.path.exists(self.filename):
+            return []
+        with self._lock(False), h5py.File(self.filename, "r") as hdf_file:
+            return [label.decode() for label in hdf_file["pairs/label"][()]]
+
+    def __contains__(self, label):
+        return label in self.labels()
+
+    def __len__(self):
+        return len(self.labels())
+
+    def append(self, results, overwrite=False):
+        """Add the results for one or more pairs.
+
+        Parameters
+        ----------
+        results : dict
+            Dictionary mapping the label for each pair to the result from
+            :code:`gw_smc_utils.batch.compute_pair_js` or the JSON files
+            written by the :code:`compute_js.py` scripts, i.e. a dictionary
+            of settings with the JS divergences for each parameter in
+            :code:`"jsd"`.
+        overwrite : bool
+            If True, replace the results for labels that are already in the
+            store, otherwise raise an error.
+        """
+        string = h5py.string_dtype()
+        with self._lock(True), h5py.File(self.filename, "a") as hdf_file:
+            if "pairs" not in hdf_file:
+                hdf_file.attrs["version"] = 1
+                for name, dtype in [
+                    ("pairs/label", string),
+                    ("pairs/settings", string),
+                    ("parameters", string),
+                    ("pair", np.int32),
+                    ("parameter", np.int32),
+                    ("replicate", np.int32),
+                    ("jsd", np.float64),
+                ]:
+                    hdf_file.create_dataset(
+                        name, shape=(0,), maxshape=(None,), dtype=dtype, chunks=True
+                    )
+            labels = [label.decode() for label in hdf_file["pairs/label"][()]]
+            existing = set(labels).intersection(results)
+            if existing:
+                if not overwrite:
+                    raise ValueError(f"Results already in the store: {existing}")
+                self._drop(hdf_file, [labels.index(label) for label in existing])
+
+            parameters = [p.decode() for p in hdf_file["parameters"][()]]
+            codes = {p: i for i, p in enumerate(parameters)}
+            first = hdf_file["pairs/label"].shape[0]
+            rows = {"pair": [], "parameter": [], "replicate": [], "jsd": []}
+            settings = []
+            for i, (label, result) in enumerate(results.items()):
+                settings.append(
+                    json.dumps(
+                        {k: v for k, v in result.items() if k not in _NOT_SETTINGS}
+                    )
+                )
+                for parameter, values in result["jsd"].items():
+                    values = np.atleast_1d(np.asarray(values, dtype=float))
+                    code = codes.setdefault(parameter, len(codes))
+                    rows["pair"].append(np.full(len(values), first + i))
+                    rows["parameter"].append(np.full(len(values), code))
+                    rows["replicate"].append(np.arange(len(values)))
+                    rows["jsd"].append(values)
+
+            _extend(hdf_file["pairs/label"], list(results))
+            _extend(hdf_file["pairs/settings"], settings)
+            _extend(hdf_file["parameters"], list(codes)[len(parameters) :])
+            for name, values in rows.items():
+                if values:
+                    _extend(hdf_file[name], np.concatenate(values))
+
+    @staticmethod
+    def _drop(hdf_file, pairs):
+        """Remove pairs and their rows, renumbering the remaining pairs."""
+        n_pairs = hdf_file["pairs/label"].shape[0]
+        keep_pair = np.ones(n_pairs, dtype=bool)
+        keep_pair[pairs] = False
+        new_index = np.cumsum(keep_pair) - 1
+        keep = keep_pair[hdf_file["pair"][()]]
+        for name in ["pairs/label", "pairs/settings"]:
+            _replace(hdf_file[name], hdf_file[name][()][keep_pair])
+        _replace(hdf_file["pair"], new_index[hdf_file["pair"][()][keep]])
+        for name in ["parameter", "replicate", "jsd"]:
+            _replace(hdf_file[name], hdf_file[name][()][keep])
+
+    def settings(self):
+        """Return a dictionary mapping each label to its settings."""
+        if not os.path.exists(self.filename):
+            return {}
+        with self._lock(False), h5py.File(self.filename, "r") as hdf_file:
+            return {
+                label.decode(): json.loads(settings)
+                for label, settings in zip(
+                    hdf_file["pairs/label"][()], hdf_file["pairs/settings"][()]
+                )
+            }
+
+    def load(self, settings=None):
+        """Load the results as a long-format DataFrame.
+
+        The DataFrame has one row per replicate with the columns
+        :code:`label`, :code:`parameter`, :code:`replicate` and
+        :code:`jsd`. The labels and parameters are categorical.
+
+        Parameters
+        ----------
+        settings : list[str], optional
+            Settings to add as columns, e.g. :code:`["res1", "n_samples"]`.
+        """
+        import pandas as pd
+
+        if not os.path.exists(self.filename):
+            return pd.DataFrame(columns=["label", "parameter", "replicate", "jsd"])
+        with self._lock(False), h5py.File(self.filename, "r") as hdf_file:
+            labels = hdf_file["pairs/label"].asstr()[()]
+            parameters = hdf_file["parameters"].asstr()[()]
+            pair = hdf_file["pair"][()]
+            columns = {
+                "label": pd.Categorical.from_codes(pair, categories=labels),
+                "parameter": pd.Categorical.from_codes(
+                    hdf_file["parameter"][()], categories=parameters
+                ),
+                "replicate": hdf_file["replicate"][()],
+                "jsd": hdf_file["jsd"][()],
+            }
+            if settings:
+                pair_settings = [json.loads(s) for s in hdf_file["pairs/settings"][()]]
+                for name in settings:
+                    # Settings can mix types, e.g. lists and None, so the
+                    # column is only numeric if every value is
+                    values = pd.Series(
+                        [s.get(name) for s in pair_settings], dtype=object
+                    ).infer_objects()
+                    columns[name] = values.to_numpy()[pair]
+        return pd.DataFrame(columns)
+
+    def summary(self, statistic="median"):
+        """Return a DataFrame of a statistic of the replicates, e.g. the
+        median, with one row per pair and one column per parameter."""
+        df = self.load()
+        return (
+            df.groupby(["label", "parameter"], observed=True)["jsd"]
+            .agg(statistic)
+            .unstack("parameter")
+        )
+
+
+def _extend(dataset, values):
+    n = dataset.shape[0]
+    dataset.resize((n + len(values),))
+    if len(values):
+        dataset[n:] = values
+
+
+def _replace(dataset, values):
+    dataset.resize((len(values),))
+    if len(values):
+        dataset[:] = values
+
+
+def store_label(filename):
+    """Label for the result in a JSON file, the path without the extension."""
+    return os.path.splitext(str(filename))[0]
+
+
+def import_json(store, pattern, label=None, overwrite=False):
+    """Add the results in the JSON files matching a glob pattern to a store.
+
+    Parameters
+    ----------
+    store : JSDStore or str
+        Store, or the path to the store, to add the results to.
+    pattern : str
+        Glob pattern for the JSON files, e.g. :code:`"jsd_results/2det/*.json"`.
+    label : callable, optional
+        Function that returns the label for a file, defaults to
+        :code:`store_label`.
+    overwrite : bool
+        If True, replace results that are already in the store.
+
+    Returns
+    -------
+    list
+        Labels of the results that were added.
+    """
+    if not isinstance(store, JSDStore):
+        store = JSDStore(store)
+    if label is None:
+        label = store_label
+    results = {}
+    for filename in sorted(glob.glob(pattern)):
+        with open(filename) as fp:
+            results[label(filename)] = json.load(fp)
+    store.append(results, overwrite=overwrite)
+    return list(results)
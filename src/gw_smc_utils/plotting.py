@@ -1,17 +1,18 @@
-from collections import namedtuple
-import importlib
+import importlib.resources
 from itertools import product
 
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.stats
-from pesummary.gw.plots.latex_labels import GWlatex_labels
 import re
 import shutil
 
+# matplotlib, scipy.stats and pesummary are slow to import, so they are
+# imported in the functions that use them
+
 
 def set_style() -> None:
     """Set the plotting style"""
+    import matplotlib.pyplot as plt
+
     with importlib.resources.path("gw_smc_utils", "paper.mplstyle") as p:
         plt.style.use(p)
     # Disable LaTeX rendering if latex is not installed
@@ -54,17 +55,30 @@ def pp_plot_from_credible_levels(
 ):
     """
     Make a P-P plot from a dataframe of credible levels.
+
+    The credible levels can also be a dictionary of arrays, e.g. from
+    :code:`gw_smc_utils.pp.compute_credible_levels`, or a
+    :code:`gw_smc_utils.pp.PPStatistics` instance, which is used to compute
+    the curves, confidence bands and p-values.
     """
+    import matplotlib.pyplot as plt
+    from pesummary.gw.plots.latex_labels import GWlatex_labels
+
+    from .pp import PPStatistics
+
+    if isinstance(credible_levels, PPStatistics):
+        stats = credible_levels
+    else:
+        stats = PPStatistics(credible_levels)
+
     if lines is None:
         colors = ["C{}".format(i) for i in range(8)]
         linestyles = ["-", "--", ":"]
         lines = ["{}{}".format(a, b) for a, b in product(linestyles, colors)]
-    if len(lines) < len(credible_levels.keys()):
+    if len(lines) < len(stats.names):
         raise ValueError("Larger number of parameters than unique linestyles")
 
-    x_values = np.linspace(0, 1, 1001)
-
-    N = len(credible_levels)
+    x_values = stats.x_values
 
     figsize = plt.rcParams["figure.figsize"].copy()
     # figsize[1] = 1.5 * figsize[1]
@@ -81,48 +95,25 @@ def pp_plot_from_credible_levels(
             "confidence_interval_alpha must have the same length as confidence_interval"
         )
 
-    for ci, alpha in zip(confidence_interval, confidence_interval_alpha):
-        edge_of_bound = (1.0 - ci) / 2.0
-        lower = scipy.stats.binom.ppf(1 - edge_of_bound, N, x_values) / N
-        upper = scipy.stats.binom.ppf(edge_of_bound, N, x_values) / N
-        # The binomial point percent function doesn't always return 0 @ 0,
-        # so set those bounds explicitly to be sure
-        lower[0] = 0
-        upper[0] = 0
+    bands = stats.confidence_bands(confidence_interval)
+    for (lower, upper), alpha in zip(bands, confidence_interval_alpha):
         ax.fill_between(x_values, lower, upper, alpha=alpha, color="k")
 
-    pvalues = []
     print("Key: KS-test p-value")
-    for ii, key in enumerate(credible_levels):
-        pp = np.array(
-            [
-                sum(credible_levels[key].values < xx) / len(credible_levels)
-                for xx in x_values
-            ]
-        )
-        pvalue = scipy.stats.kstest(credible_levels[key], "uniform").pvalue
-        pvalues.append(pvalue)
+    for ii, key in enumerate(stats.names):
+        pvalue = stats.pvalues[key]
         print(f"{key}: {pvalue}")
 
         name = GWlatex_labels.get(key, key)
         name = re.sub(r"\[.*?\]", "", name)
         label = "{} ({:2.3f})".format(name, pvalue)
-        plt.plot(x_values, pp, lines[ii], label=label, **kwargs)
+        plt.plot(x_values, stats.curve(key), lines[ii], label=label, **kwargs)
 
-    Pvals = namedtuple("pvals", ["combined_pvalue", "pvalues", "names"])
-    pvals = Pvals(
-        combined_pvalue=scipy.stats.combine_pvalues(pvalues)[1],
-        pvalues=pvalues,
-        names=list(credible_levels.keys()),
-    )
+    pvals = stats.summary()
     print("Combined p-value: {}".format(pvals.combined_pvalue))
 
     if title:
-        ax.set_title(
-            "N={}, $p$-value={:2.4f}".format(
-                len(credible_levels), pvals.combined_pvalue
-            )
-        )
+        ax.set_title("N={}, $p$-value={:2.4f}".format(stats.n, pvals.combined_pvalue))
     ax.set_xlabel("C.I.")
     ax.set_ylabel("Fraction of events in C.I.")
     ax.set_xlim(0, 1)
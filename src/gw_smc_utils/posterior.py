@@ -1,15 +1,412 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
 import h5py
+import numpy as np
+
+# Number of rows to read at once from datasets that are not chunked
+DEFAULT_BLOCK_ROWS = 2**16
+
+
+def _read_plan(indices, block_rows):
+    """Group sorted row indices into reads of contiguous ranges.
+
+    Each range covers the indices that fall in the same block of
+    :code:`block_rows` rows, e.g. the same HDF5 chunk, so that every chunk is
+    read at most once.
+
+    Returns a list of :code:`(start, stop, local, out)` tuples, where
+    :code:`local` are the indices relative to :code:`start` and :code:`out`
+    is the corresponding slice of the output.
+    """
+    blocks = indices // block_rows
+    splits = np.flatnonzero(np.diff(blocks)) + 1
+    bounds = np.concatenate([[0], splits, [len(indices)]])
+    plan = []
+    for i, j in zip(bounds[:-1], bounds[1:]):
+        start = int(indices[i])
+        stop = int(indices[j - 1]) + 1
+        plan.append((start, stop, indices[i:j] - start, slice(i, j)))
+    return plan
+
+
+def _read_rows(dataset, indices, dtype=None, plan=None):
+    """Read the given sorted rows from a dataset by reading whole chunks."""
+    if plan is None:
+        block_rows = dataset.chunks[0] if dataset.chunks else DEFAULT_BLOCK_ROWS
+        plan = _read_plan(indices, block_rows)
+    out = np.empty(len(indices), dtype=dtype or dataset.dtype)
+    for start, stop, local, out_slice in plan:
+        out[out_slice] = dataset[start:stop][local]
+    return out
+
+
+def _select_rows(n_rows, rows=None, n_samples=None, seed=None):
+    """Convert the row selection for :code:`load_bilby_posterior` to either
+    :code:`None`, a slice or a sorted array of unique indices."""
+    if n_samples is not None:
+        candidates = np.arange(n_rows)
+        if rows is not None:
+            candidates = candidates[rows]
+        if n_samples >= len(candidates):
+            print(
+                f"Warning: n_samples ({n_samples}) is not less than the "
+                f"number of rows ({len(candidates)}). Reading all rows."
+            )
+            return candidates
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(candidates, size=n_samples, replace=False))
+    elif rows is not None and not isinstance(rows, slice):
+        return np.unique(rows)
+    return rows
+
+
+def load_bilby_posterior(
+    filename: str,
+    keys: list[str] = None,
+    rows=None,
+    n_samples: int = None,
+    seed: int = None,
+    dtype: str = None,
+    cache=None,
+):
+    """Load just the posterior from a bilby hdf5 result object.
+
+    By default every row is read. A subset of the rows can be read by
+    specifying either :code:`rows` or :code:`n_samples`, or both.
 
+    Parameters
+    ----------
+    filename : str
+        Path to the result file.
+    keys : list[str], optional
+        Parameters to load. If not specified, all the parameters are loaded.
+    rows : slice or array_like, optional
+        Rows to read, either a slice, e.g. :code:`slice(0, 10000)` for a
+        contiguous block or :code:`slice(None, None, 10)` for every tenth
+        row, or an array of row indices, which are sorted and any duplicates
+        removed. Arrays of indices are read one chunk at a time, with the
+        same reads used for every column, which is faster than fancy
+        indexing in h5py.
+    n_samples : int, optional
+        If specified, read a random subset of this many rows (from
+        :code:`rows` if also specified). The indices are sorted, so the
+        subset is in the same order as in the file. If there are not more
+        rows than this, all of them are read.
+    seed : int, optional
+        Random seed for choosing the subset, the same seed always gives the
+        same rows for a given file.
+    dtype : str, optional
+        Data type for the floating point columns, e.g. :code:`"float32"`. The
+        conversion is done while reading.
+    cache : PosteriorCache or str, optional
+        Cache, or the directory for a cache, to load the posterior from. See
+        :code:`PosteriorCache`.
+    """
+    if cache is not None:
+        if not isinstance(cache, PosteriorCache):
+            cache = PosteriorCache(cache)
+        return cache.load(
+            filename, keys=keys, rows=rows, n_samples=n_samples, seed=seed, dtype=dtype
+        )
 
-def load_bilby_posterior(filename: str, keys: list[str] = None):
-    """Load just the posterior from a bilby hdf5 result object."""
     posterior = {}
     with h5py.File(filename, "r") as hdf_file:
+        group = hdf_file["posterior"]
         if keys is None:
-            keys = hdf_file["posterior"].keys()
+            keys = group.keys()
+        missing = [key for key in keys if key not in group]
+        for key in missing:
+            print(f"Key {key} not found in posterior")
+        keys = [key for key in keys if key not in missing]
+        if not keys:
+            return posterior
+
+        rows = _select_rows(len(group[keys[0]]), rows, n_samples, seed)
+
+        # Columns with the same chunking share the same plan
+        plans = {}
         for key in keys:
-            if key not in hdf_file["posterior"]:
-                print(f"Key {key} not found in posterior")
+            dataset = group[key]
+            key_dtype = dtype if np.issubdtype(dataset.dtype, np.floating) else None
+            if isinstance(rows, np.ndarray):
+                block_rows = dataset.chunks[0] if dataset.chunks else DEFAULT_BLOCK_ROWS
+                if block_rows not in plans:
+                    plans[block_rows] = _read_plan(rows, block_rows)
+                posterior[key] = _read_rows(
+                    dataset, rows, dtype=key_dtype, plan=plans[block_rows]
+                )
             else:
-                posterior[key] = hdf_file[f"posterior/{key}"][()]
+                if key_dtype is not None:
+                    dataset = dataset.astype(key_dtype)
+                posterior[key] = dataset[rows if rows is not None else ()]
     return posterior
+
+
+def iter_bilby_posteriors(
+    filenames,
+    keys: list[str] = None,
+    n_workers: int = None,
+    processes: bool = False,
+    max_pending: int = None,
+    **kwargs,
+):
+    """Load the posteriors from many bilby result files concurrently.
+
+    The posteriors are yielded in the same order as :code:`filenames`. At
+    most :code:`max_pending` files are read ahead of the one being yielded,
+    so the memory usage is bounded as long as the posteriors are not all
+    kept.
+
+    Parameters
+    ----------
+    filenames : list or dict
+        Result files to read. If a dictionary, the keys are used as the
+        labels, otherwise the filenames are used.
+    keys : list[str], optional
+        Parameters to load, e.g. the parameters and the weights.
+    n_workers : int, optional
+        Number of threads or processes to use.
+    processes : bool
+        If True, use processes instead of threads. h5py holds a lock while
+        reading, so threads help when waiting for shared storage whereas
+        processes also parallelise decompressing the data.
+    max_pending : int, optional
+        Maximum number of files to read ahead. Defaults to twice the number
+        of workers.
+
+    Other keyword arguments are passed to :code:`load_bilby_posterior`.
+
+    Yields
+    ------
+    tuple
+        The label and the posterior for each file.
+    """
+    if isinstance(filenames, dict):
+        items = iter(filenames.items())
+    else:
+        items = ((filename, filename) for filename in filenames)
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+        if not processes:
+            n_workers = min(32, n_workers + 4)
+    if max_pending is None:
+        max_pending = 2 * n_workers
+
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with Executor(n_workers) as executor:
+        pending = deque()
+
+        def submit():
+            item = next(items, None)
+            if item is not None:
+                label, filename = item
+                future = executor.submit(load_bilby_posterior, filename, keys, **kwargs)
+                pending.append((label, future))
+
+        for _ in range(max_pending):
+            submit()
+        while pending:
+            label, future = pending.popleft()
+            submit()
+            yield label, future.result()
+
+
+def load_bilby_posteriors(filenames, keys: list[str] = None, **kwargs):
+    """Load the posteriors from many bilby result files concurrently.
+
+    See :code:`iter_bilby_posteriors` for the arguments. Returns a dictionary
+    mapping each label to the posterior.
+    """
+    return dict(iter_bilby_posteriors(filenames, keys, **kwargs))
+
+
+class PosteriorCache:
+    """On-disk cache of the posterior columns in bilby result files.
+
+    The first time a result file is loaded, every column of the posterior is
+    written to an uncompressed :code:`.npy` file in :code:`directory`. Later
+    loads memory-map these files, so they avoid decompressing the HDF5 file
+    and only the rows that are used are read from disk.
+
+    Entries are keyed by the absolute path, size and modification time of
+    the result file, so modifying or replacing a file results in a new
+    entry, and the entries for older versions of the file are removed.
+    Entries are written to a temporary directory, locked while it is being
+    written, and then renamed, so the cache can be shared between processes
+    and jobs.
+
+    Parameters
+    ----------
+    directory : str
+        Directory for the cache.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(filename):
+        """Return the key for a result file."""
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        key = f"{filename}:{stat.st_size}:{stat.st_mtime_ns}"
+        return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+    def _path(self, filename):
+        return self.directory / self.key(filename)
+
+    def __contains__(self, filename):
+        return (self._path(filename) / "columns.json").exists()
+
+    def _convert(self, filename, path):
+        tmp = Path(tempfile.mkdtemp(dir=self.directory, prefix=".tmp_"))
+        lock = open(tmp / ".lock", "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            keys = []
+            columns = []
+            with h5py.File(filename, "r") as hdf_file:
+                for key, dataset in hdf_file["posterior"].items():
+                    if not isinstance(dataset, h5py.Dataset):
+                        continue
+                    keys.append(key)
+                    # Only numeric columns can be memory-mapped
+                    if dataset.dtype.kind not in "biuf":
+                        continue
+                    np.save(
+                        tmp / f"{len(columns)}.npy", dataset[()], allow_pickle=False
+                    )
+                    columns.append(key)
+            manifest = {
+                "filename": os.path.abspath(filename),
+                "keys": keys,
+                "columns": columns,
+            }
+            with open(tmp / "columns.json", "w") as fp:
+                json.dump(manifest, fp)
+            os.remove(tmp / ".lock")
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another process has already added this entry
+                pass
+            else:
+                self._remove_stale(manifest["filename"], path.name)
+        finally:
+            lock.close()
+            if tmp.exists():
+                shutil.rmtree(tmp)
+
+    def _remove_stale(self, filename, key):
+        """Remove the entries for older versions of a result file."""
+        for path in self.directory.iterdir():
+            if path.name == key or path.name.startswith("."):
+                continue
+            try:
+                with open(path / "columns.json") as fp:
+                    stale = json.load(fp)["filename"] == filename
+            except (OSError, ValueError):
+                continue
+            if stale:
+                self._discard(path)
+
+    def _discard(self, path):
+        """Remove an entry, renaming it first so that it disappears from the
+        cache in one step."""
+        trash = Path(tempfile.mkdtemp(dir=self.directory, prefix=".stale_"))
+        try:
+            os.rename(path, trash / path.name)
+        except OSError:
+            # Another process has already removed it
+            pass
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _manifest(self, filename):
+        path = self._path(filename)
+        if not (path / "columns.json").exists():
+            self._convert(filename, path)
+        with open(path / "columns.json") as fp:
+            return path, json.load(fp)
+
+    def columns(self, filename):
+        """Return read-only memory-maps of the cached posterior columns,
+        adding the file to the cache if needed."""
+        path, manifest = self._manifest(filename)
+        return {
+            key: np.load(path / f"{i}.npy", mmap_mode="r")
+            for i, key in enumerate(manifest["columns"])
+        }
+
+    def load(
+        self, filename, keys=None, rows=None, n_samples=None, seed=None, dtype=None
+    ):
+        """Load the posterior, see :code:`load_bilby_posterior` for the
+        arguments.
+
+        If all the rows are loaded and the data type is not changed, the
+        columns are the memory-maps themselves and no data is copied.
+        Columns that could not be cached, e.g. strings, are read from the
+        result file.
+        """
+        if keys is None:
+            keys = self._manifest(filename)[1]["keys"]
+        columns = self.columns(filename)
+        uncached = [key for key in keys if key not in columns]
+        posterior = {}
+        if uncached:
+            posterior.update(
+                load_bilby_posterior(filename, uncached, rows, n_samples, seed, dtype)
+            )
+        cached = [key for key in keys if key in columns]
+        if not cached:
+            return posterior
+        rows = _select_rows(len(columns[cached[0]]), rows, n_samples, seed)
+        for key in cached:
+            value = columns[key]
+            if rows is not None:
+                value = value[rows]
+            if dtype is not None and np.issubdtype(value.dtype, np.floating):
+                value = value.astype(dtype)
+            posterior[key] = value
+        return {key: posterior[key] for key in keys if key in posterior}
+
+    def clear(self):
+        """Remove all the entries in the cache.
+
+        Temporary directories that another process is still writing are
+        left in place.
+        """
+        for path in self.directory.iterdir():
+            if not path.is_dir():
+                continue
+            if path.name.startswith(".tmp_"):
+                self._remove_abandoned(path)
+            elif path.name.startswith(".stale_"):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                self._discard(path)
+
+    @staticmethod
+    def _remove_abandoned(path):
+        """Remove a temporary directory if the process writing it has
+        finished or died, i.e. its lock can be taken."""
+        try:
+            lock = open(path / ".lock")
+        except OSError:
+            # Not locked yet, or the entry has just been renamed
+            return
+        with lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,427 @@
+"""
+Credible levels of injected values for probability-probability tests.
+"""
+
+import json
+import os
+import tempfile
+from collections import namedtuple
+from functools import lru_cache
+
+import h5py
+import numpy as np
+
+from .posterior import iter_bilby_posteriors
+
+
+def _injected_values(injections, keys):
+    """Convert the injections to an array with shape (n_injections, n_keys).
+
+    The injections can be a sequence of dictionaries, e.g. the records from
+    a dataframe, or a mapping from each parameter to an array, e.g. a
+    dataframe.
+    """
+    if hasattr(injections, "keys"):
+        missing = [key for key in keys if key not in injections]
+        if missing:
+            raise ValueError(f"Parameters {missing} not found in injections")
+        return np.column_stack(
+            [np.asarray(injections[key], dtype=float) for key in keys]
+        )
+    values = []
+    for injection in injections:
+        missing = [key for key in keys if key not in injection]
+        if missing:
+            raise ValueError(f"Parameters {missing} not found in injections")
+        values.append([injection[key] for key in keys])
+    return np.array(values, dtype=float).reshape(-1, len(keys))
+
+
+def _wrap(x, lower, upper):
+    return lower + np.mod(x - lower, upper - lower)
+
+
+def _chunk_credible_levels(posteriors, injected, keys, weights, periodic):
+    lengths = np.array([len(posterior[keys[0]]) for posterior in posteriors])
+    levels = np.full((len(posteriors), len(keys)), np.nan)
+    # np.add.reduceat does not handle empty segments
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return levels
+    posteriors = [p for p, keep in zip(posteriors, nonempty) if keep]
+    lengths = lengths[nonempty]
+    injected = injected[nonempty]
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    if weights is None:
+        w = None
+        norm = lengths
+    else:
+        if isinstance(weights, str):
+            w = [posterior[weights] for posterior in posteriors]
+        else:
+            w = [weights_i for weights_i, keep in zip(weights, nonempty) if keep]
+        w = np.concatenate([np.asarray(w_i, dtype=float) for w_i in w])
+        norm = np.add.reduceat(w, offsets)
+
+    for j, key in enumerate(keys):
+        x = np.concatenate([np.asarray(p[key], dtype=float) for p in posteriors])
+        value = np.repeat(injected[:, j], lengths)
+        if key in periodic:
+            x = _wrap(x, *periodic[key])
+            value = _wrap(value, *periodic[key])
+        below = x < value
+        if w is not None:
+            below = below * w
+        levels[nonempty, j] = np.add.reduceat(below, offsets) / norm
+    return levels
+
+
+def compute_credible_levels(
+    posteriors,
+    injections,
+    keys,
+    weights=None,
+    periodic=None,
+    max_bytes=2**26,
+):
+    """Compute the credible level of the injected value of each parameter for
+    each posterior.
+
+    The credible level is the (weighted) fraction of the posterior samples
+    that are less than the injected value. The posteriors can have different
+    numbers of samples. They are processed in chunks of at most
+    :code:`max_bytes` of samples, so :code:`posteriors` can be an iterator,
+    e.g. from :code:`gw_smc_utils.posterior.iter_bilby_posteriors`, and they
+    do not all need to be in memory.
+
+    Parameters
+    ----------
+    posteriors : iterable
+        Posteriors, each a mapping from parameter to samples. The i-th
+        posterior corresponds to the i-th injection.
+    injections : sequence of dict or dict
+        Injected values, either one dictionary per injection, or a mapping
+        (e.g. a dataframe) from each parameter to the injected values.
+    keys : list[str]
+        Parameters to compute the credible levels for.
+    weights : str or sequence, optional
+        Either the name of the column in each posterior with the weights or
+        a sequence of weights for each posterior.
+    periodic : dict, optional
+        Dictionary mapping periodic parameters to their (lower, upper)
+        bounds. The samples and the injected values are wrapped to these
+        bounds before being compared.
+    max_bytes : int
+        Approximate size of the samples to process at once.
+
+    Returns
+    -------
+    dict
+        Dictionary mapping each parameter to an array of the credible levels
+        for each injection. Empty posteriors have credible levels of NaN.
+    """
+    keys = list(keys)
+    periodic = {} if periodic is None else periodic
+    injected = _injected_values(injections, keys)
+    weights_iter = (
+        iter(weights) if weights is not None and not isinstance(weights, str) else None
+    )
+
+    levels = []
+    chunk = []
+    chunk_weights = []
+    nbytes = 0
+    start = 0
+    for posterior in posteriors:
+        if start + len(chunk) >= len(injected):
+            raise ValueError("More posteriors than injections")
+        chunk.append(posterior)
+        if weights_iter is not None:
+            chunk_weights.append(next(weights_iter))
+        nbytes += 8 * len(keys) * len(posterior[keys[0]])
+        if nbytes >= max_bytes:
+            levels.append(
+                _chunk_credible_levels(
+                    chunk,
+                    injected[start : start + len(chunk)],
+                    keys,
+                    chunk_weights or weights,
+                    periodic,
+                )
+            )
+            start += len(chunk)
+            chunk, chunk_weights, nbytes = [], [], 0
+    if chunk:
+        levels.append(
+            _chunk_credible_levels(
+                chunk,
+                injected[start : start + len(chunk)],
+                keys,
+                chunk_weights or weights,
+                periodic,
+            )
+        )
+    if not levels:
+        return {key: np.empty(0) for key in keys}
+    levels = np.concatenate(levels)
+    return {key: levels[:, j] for j, key in enumerate(keys)}
+
+
+def file_identity(filename):
+    """Return the absolute path, size and modification time of a file."""
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    return filename, stat.st_size, stat.st_mtime_ns
+
+
+class CredibleLevelsStore:
+    """Incremental store of the credible levels for each injection.
+
+    For each injection, the store records the identity (path, size and
+    modification time) of the result file the credible levels were computed
+    from. :code:`update` only reads the result files that are new or have
+    changed since they were added, so the P-P test can be refreshed while
+    runs are still finishing.
+
+    The store is a small HDF5 file that is rewritten atomically after each
+    update.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the HDF5 file for the store.
+    keys : list[str]
+        Parameters to compute the credible levels for. If these differ from
+        the parameters in an existing store, all the credible levels are
+        recomputed on the next update.
+    """
+
+    def __init__(self, filename, keys):
+        self.filename = filename
+        self.keys = list(keys)
+        self.ids = []
+        self.identities = []
+        self.levels = np.empty((0, len(self.keys)))
+        if os.path.exists(filename):
+            self._read()
+
+    def _read(self):
+        with h5py.File(self.filename, "r") as hdf_file:
+            if json.loads(hdf_file.attrs["keys"]) != self.keys:
+                print("Parameters have changed, all credible levels will be recomputed")
+                return
+            self.ids = [i.decode() for i in hdf_file["ids"][()]]
+            self.identities = [
+                (path.decode(), int(size), int(mtime))
+                for path, size, mtime in zip(
+                    hdf_file["paths"][()], hdf_file["sizes"][()], hdf_file["mtimes"][()]
+                )
+            ]
+            self.levels = hdf_file["credible_levels"][()]
+
+    def _write(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            with h5py.File(tmp, "w") as hdf_file:
+                hdf_file.attrs["keys"] = json.dumps(self.keys)
+                string = h5py.string_dtype()
+                hdf_file.create_dataset("ids", data=self.ids, dtype=string)
+                paths, sizes, mtimes = (
+                    zip(*self.identities) if self.identities else ([], [], [])
+                )
+                hdf_file.create_dataset("paths", data=list(paths), dtype=string)
+                hdf_file.create_dataset("sizes", data=np.array(sizes, dtype=np.int64))
+                hdf_file.create_dataset("mtimes", data=np.array(mtimes, dtype=np.int64))
+                hdf_file.create_dataset("credible_levels", data=self.levels)
+            os.replace(tmp, self.filename)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def stale(self, result_files):
+        """Return the IDs of the result files that are new or have changed.
+
+        Parameters
+        ----------
+        result_files : dict
+            Dictionary mapping each injection ID to its result file.
+        """
+        current = dict(zip(self.ids, self.identities))
+        return [
+            inj_id
+            for inj_id, filename in result_files.items()
+            if current.get(str(inj_id)) != file_identity(filename)
+        ]
+
+    def update(self, result_files, injections, weights=None, periodic=None, **kwargs):
+        """Compute the credible levels for the new or changed result files.
+
+        Parameters
+        ----------
+        result_files : dict
+            Dictionary mapping each injection ID to its result file.
+        injections : dict
+            Dictionary mapping each injection ID to the injected values.
+        weights, periodic
+            See :code:`compute_credible_levels`.
+
+        Other keyword arguments are passed to :code:`iter_bilby_posteriors`.
+
+        Returns
+        -------
+        list
+            The IDs that were added or updated.
+        """
+        stale = self.stale(result_files)
+        if not stale:
+            return stale
+        identities = [file_identity(result_files[inj_id]) for inj_id in stale]
+        read_keys = self.keys + ([weights] if isinstance(weights, str) else [])
+        posteriors = (
+            posterior
+            for _, posterior in iter_bilby_posteriors(
+                {inj_id: result_files[inj_id] for inj_id in stale}, read_keys, **kwargs
+            )
+        )
+        levels = compute_credible_levels(
+            posteriors,
+            [injections[inj_id] for inj_id in stale],
+            self.keys,
+            weights=weights,
+            periodic=periodic,
+        )
+        levels = np.column_stack([levels[key] for key in self.keys])
+
+        rows = {inj_id: i for i, inj_id in enumerate(self.ids)}
+        new = []
+        for inj_id, identity, row in zip(stale, identities, levels):
+            inj_id = str(inj_id)
+            if inj_id in rows:
+                self.identities[rows[inj_id]] = identity
+                self.levels[rows[inj_id]] = row
+            else:
+                self.ids.append(inj_id)
+                self.identities.append(identity)
+                new.append(row)
+        if new:
+            self.levels = np.concatenate([self.levels, new])
+        self._write()
+        return stale
+
+    def credible_levels(self, ids=None):
+        """Return a dictionary mapping each parameter to the credible levels.
+
+        If :code:`ids` is given, only the credible levels for these
+        injections are returned, in the same order.
+        """
+        levels = self.levels
+        if ids is not None:
+            rows = {inj_id: i for i, inj_id in enumerate(self.ids)}
+            levels = levels[[rows[str(inj_id)] for inj_id in ids]]
+        return {key: levels[:, j] for j, key in enumerate(self.keys)}
+
+
+PValues = namedtuple("pvals", ["combined_pvalue", "pvalues", "names"])
+
+
+@lru_cache(maxsize=128)
+def confidence_band(n, confidence_interval, n_points=1001):
+    """Return the binomial confidence band for a P-P plot with :code:`n`
+    injections, evaluated at :code:`n_points` between zero and one.
+
+    The results are cached, the arrays returned are read-only.
+    """
+    import scipy.stats
+
+    x_values = np.linspace(0, 1, n_points)
+    edge_of_bound = (1.0 - confidence_interval) / 2.0
+    lower = scipy.stats.binom.ppf(1 - edge_of_bound, n, x_values) / n
+    upper = scipy.stats.binom.ppf(edge_of_bound, n, x_values) / n
+    # The binomial point percent function doesn't always return 0 @ 0,
+    # so set those bounds explicitly to be sure
+    lower[0] = 0
+    upper[0] = 0
+    lower.flags.writeable = False
+    upper.flags.writeable = False
+    return lower, upper
+
+
+class PPStatistics:
+    """Statistics for a probability-probability test.
+
+    Computes the P-P curves, the confidence bands and the p-values without
+    making a plot, see :code:`gw_smc_utils.plotting.pp_plot_from_credible_levels`
+    for the plot.
+
+    Parameters
+    ----------
+    credible_levels : dict or pandas.DataFrame
+        Credible levels for each parameter, e.g. from
+        :code:`compute_credible_levels`.
+    n_points : int
+        Number of points between zero and one at which to evaluate the
+        curves and confidence bands.
+    """
+
+    def __init__(self, credible_levels, n_points=1001):
+        self.credible_levels = {
+            key: np.asarray(credible_levels[key], dtype=float)
+            for key in credible_levels.keys()
+        }
+        self.names = list(self.credible_levels)
+        self.n = len(self.credible_levels[self.names[0]]) if self.names else 0
+        self.x_values = np.linspace(0, 1, n_points)
+        self._pvalues = None
+
+    def curve(self, key):
+        """Fraction of the credible levels for a parameter that are less than
+        each of :code:`x_values`."""
+        levels = np.sort(self.credible_levels[key])
+        return np.searchsorted(levels, self.x_values, side="left") / self.n
+
+    def curves(self):
+        """Dictionary of the P-P curves for each parameter."""
+        return {key: self.curve(key) for key in self.names}
+
+    def confidence_bands(self, confidence_interval=(0.68, 0.95, 0.997)):
+        """List of the (lower, upper) confidence bands for each interval."""
+        if isinstance(confidence_interval, float):
+            confidence_interval = [confidence_interval]
+        return [
+            confidence_band(self.n, float(ci), len(self.x_values))
+            for ci in confidence_interval
+        ]
+
+    @property
+    def pvalues(self):
+        """Dictionary of the KS-test p-values for each parameter."""
+        if self._pvalues is None:
+            import scipy.stats
+
+            self._pvalues = {
+                key: scipy.stats.kstest(levels, "uniform").pvalue
+                for key, levels in self.credible_levels.items()
+            }
+        return self._pvalues
+
+    @property
+    def combined_pvalue(self):
+        """Combined p-value for all the parameters using Fisher's method."""
+        import scipy.stats
+
+        return scipy.stats.combine_pvalues(list(self.pvalues.values()))[1]
+
+    def summary(self):
+        """Return the p-values as a named tuple with the combined p-value,
+        the p-value for each parameter and the parameter names."""
+        return PValues(
+            combined_pvalue=self.combined_pvalue,
+            pvalues=list(self.pvalues.values()),
+            names=self.names,
+        )
@@ -6,7 +6,15 @@ def find_gwtc_results(
     data_releases,
     event,
     cosmo,
+    catalog=None,
 ):
+    """Find the data release file for an event.
+
+    If a :code:`gw_smc_utils.catalog.ResultCatalog` is given, it is refreshed
+    and queried instead of searching each release directory.
+    """
+    if catalog is not None:
+        catalog.refresh(data_release_path)
     for release in data_releases:
         if cosmo:
             suffix = "cosmo"
@@ -15,7 +23,21 @@ def find_gwtc_results(
         release_path = pathlib.Path(f"{data_release_path}/{release}/")
         if not release_path.exists():
             raise RuntimeError(f"Release path {release_path} does not exist")
-        matches = list(release_path.glob(f"*-{event}_*{suffix}.h5"))
+        if catalog is not None:
+            matches = [
+                path
+                for path in catalog.find(
+                    kind="gwtc", event=event, cosmo=cosmo, directory=release_path
+                )
+                if path.parent.name == release
+            ]
+        else:
+            matches = [
+                path
+                for path in release_path.glob(f"*-{event}_*{suffix}.h5")
+                # The cosmo pattern also matches the nocosmo files
+                if path.name.endswith("nocosmo.h5") != bool(cosmo)
+            ]
         if len(matches) > 1:
             raise RuntimeError("Found more than one file")
         elif len(matches) == 0:
@@ -0,0 +1,151 @@
+"""
+Share posterior samples with pool workers without pickling them.
+"""
+
+import os
+import tempfile
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+SharedHandle = namedtuple("SharedHandle", ["backend", "name", "layout"])
+
+# Buffers attached in this process, keyed by name
+_attached = {}
+# Names of the buffers created by this process
+_owned = set()
+
+
+class SharedPosterior:
+    """Store the columns of one or more posteriors in a single shared buffer.
+
+    The buffer is either a :code:`multiprocessing.shared_memory` block or a
+    memory-mapped scratch file. Only the small, picklable :code:`handle` needs
+    to be sent to pool workers, which call :code:`attach` to get read-only
+    views of the columns without copying them.
+
+    Parameters
+    ----------
+    columns : dict
+        Dictionary of 1-dimensional arrays to share.
+    backend : str
+        Either :code:`"shared_memory"` or :code:`"memmap"`.
+    directory : str, optional
+        Directory for the scratch file when using :code:`"memmap"`.
+    """
+
+    def __init__(self, columns, backend="shared_memory", directory=None):
+        if backend not in ("shared_memory", "memmap"):
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
+        self._shm = None
+        self._path = None
+
+        layout = {}
+        offset = 0
+        arrays = {}
+        for key, value in columns.items():
+            value = np.ascontiguousarray(value)
+            arrays[key] = value
+            layout[key] = (offset, value.dtype.str, value.shape)
+            # Keep each column aligned to 8 bytes
+            offset += -(-value.nbytes // 8) * 8
+        size = max(offset, 1)
+
+        if backend == "shared_memory":
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            name = self._shm.name
+            buffer = self._shm.buf
+        else:
+            fd, self._path = tempfile.mkstemp(
+                dir=directory, prefix="gw_smc_", suffix=".dat"
+            )
+            os.close(fd)
+            buffer = np.memmap(self._path, dtype=np.uint8, mode="w+", shape=(size,))
+            name = self._path
+
+        views = _views(buffer, layout)
+        for key, value in arrays.items():
+            views[key][...] = value
+            views[key].flags.writeable = False
+        if backend == "memmap":
+            buffer.flush()
+
+        self.handle = SharedHandle(backend, name, layout)
+        _attached[name] = (self._shm if backend == "shared_memory" else buffer, views)
+        _owned.add(name)
+
+    @property
+    def columns(self):
+        """Read-only views of the shared columns in this process."""
+        return _attached[self.handle.name][1]
+
+    def close(self):
+        """Release and remove the shared buffer."""
+        _attached.pop(self.handle.name, None)
+        _owned.discard(self.handle.name)
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+        if self._path is not None:
+            os.remove(self._path)
+            self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _views(buffer, layout):
+    return {
+        key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        for key, (offset, dtype, shape) in layout.items()
+    }
+
+
+def attach(handle):
+    """Return read-only views of the columns for a :code:`SharedHandle`.
+
+    Each process only attaches to a given buffer once. Attaching to a new
+    buffer releases any buffers previously attached from other processes,
+    since pool workers only see tasks from one call at a time.
+    """
+    if handle.name not in _attached:
+        _release_attached()
+        if handle.backend == "shared_memory":
+            try:
+                buffer = shared_memory.SharedMemory(name=handle.name, track=False)
+            except TypeError:
+                # Python < 3.13 registers the block with the resource tracker
+                # when attaching, which would remove it when the worker exits
+                register = resource_tracker.register
+                resource_tracker.register = lambda *args, **kwargs: None
+                try:
+                    buffer = shared_memory.SharedMemory(name=handle.name)
+                finally:
+                    resource_tracker.register = register
+            views = _views(buffer.buf, handle.layout)
+        else:
+            buffer = np.memmap(handle.name, dtype=np.uint8, mode="r")
+            views = _views(buffer, handle.layout)
+        for view in views.values():
+            view.flags.writeable = False
+        _attached[handle.name] = (buffer, views)
+    return _attached[handle.name][1]
+
+
+def _release_attached():
+    for name in list(_attached):
+        if name in _owned:
+            continue
+        buffer, _ = _attached.pop(name)
+        if isinstance(buffer, shared_memory.SharedMemory):
+            try:
+                buffer.close()
+            except BufferError:
+                # Views of the buffer are still in use elsewhere
+                pass
@@ -0,0 +1,144 @@
+"""
+Collect summary statistics, e.g. the sampling time and evidence, from many
+bilby result files.
+"""
+
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+# Summary statistics and the corresponding scalar datasets in the result file
+SCALARS = {
+    "sampling_time": "sampling_time",
+    "likelihood_evaluations": "num_likelihood_evaluations",
+    "log_evidence": "log_evidence",
+    "log_evidence_error": "log_evidence_err",
+}
+
+
+def _resolve(pattern):
+    """Return the first file matching a path or glob pattern, or None."""
+    if pattern is None:
+        return None
+    if glob.has_magic(str(pattern)):
+        matches = sorted(glob.glob(str(pattern)))
+        return matches[0] if matches else None
+    return str(pattern) if os.path.exists(pattern) else None
+
+
+def read_run_summary(result_file, timing_file=None, scalars=None, posterior_key=None):
+    """Read the summary statistics for a single run.
+
+    Only the scalar datasets and the shape of the posterior are read, not
+    the samples themselves. Statistics that are not in the file are NaN.
+
+    Parameters
+    ----------
+    result_file : str
+        Path to the bilby result file.
+    timing_file : str, optional
+        Text file containing the sampling time, e.g. the
+        :code:`sampling_time.dat` file written by pocomc. If given, this is
+        used for the sampling time instead of the result file.
+    scalars : dict, optional
+        Dictionary mapping the name of each statistic to the dataset in the
+        result file. Defaults to :code:`SCALARS`.
+    posterior_key : str, optional
+        Parameter to use to count the number of posterior samples. Defaults
+        to the first parameter in the posterior.
+
+    Returns
+    -------
+    dict
+        Dictionary of the statistics and the number of posterior samples,
+        :code:`n_samples`.
+    """
+    if scalars is None:
+        scalars = SCALARS
+    summary = {}
+    with h5py.File(result_file, "r") as f:
+        for name, key in scalars.items():
+            summary[name] = float(f[key][()]) if key in f else np.nan
+        posterior = f.get("posterior")
+        if posterior is not None and len(posterior):
+            if posterior_key is None:
+                posterior_key = next(iter(posterior))
+            summary["n_samples"] = posterior[posterior_key].shape[0]
+        else:
+            summary["n_samples"] = np.nan
+    if timing_file is not None:
+        summary["sampling_time"] = float(np.loadtxt(timing_file))
+    return summary
+
+
+def _summarise_run(entry, kwargs):
+    result_file = _resolve(entry.get("result"))
+    if result_file is None:
+        return None, f"No result file matching {entry.get('result')}"
+    try:
+        timing_file = _resolve(entry.get("timing"))
+        return read_run_summary(result_file, timing_file=timing_file, **kwargs), None
+    except (OSError, KeyError, ValueError) as e:
+        return None, f"Could not read {result_file}: {e}"
+
+
+def collect_run_summaries(manifest, n_workers=None, processes=False, **kwargs):
+    """Read the summary statistics for many runs concurrently.
+
+    The manifest lists the expected runs, runs without a result file or
+    whose result file cannot be read are reported rather than raising an
+    error.
+
+    Parameters
+    ----------
+    manifest : dict
+        Dictionary mapping each run ID to a dictionary with the path or glob
+        pattern for the :code:`"result"` file and, optionally, the
+        :code:`"timing"` file. The patterns are resolved by the workers.
+    n_workers : int, optional
+        Number of threads or processes to use.
+    processes : bool
+        If True, use processes instead of threads.
+
+    Other keyword arguments are passed to :code:`read_run_summary`.
+
+    Returns
+    -------
+    summaries : dict
+        Dictionary mapping the ID of each run that was read to its summary.
+    missing : dict
+        Dictionary mapping the ID of each run that could not be read to the
+        reason.
+    """
+    Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with Executor(n_workers) as executor:
+        futures = {
+            run_id: executor.submit(_summarise_run, entry, kwargs)
+            for run_id, entry in manifest.items()
+        }
+        summaries = {}
+        missing = {}
+        for run_id, future in futures.items():
+            summary, reason = future.result()
+            if summary is None:
+                missing[run_id] = reason
+            else:
+                summaries[run_id] = summary
+    return summaries, missing
+
+
+def summary_arrays(summaries, ids, names=None):
+    """Convert the summaries to a dictionary of arrays ordered by
+    :code:`ids`, with NaN for the runs that are missing."""
+    if names is None:
+        names = list(SCALARS) + ["n_samples"]
+    return {
+        name: np.array(
+            [summaries.get(i, {}).get(name, np.nan) for i in ids],
+            dtype=float,
+        )
+        for name in names
+    }
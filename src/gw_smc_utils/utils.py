@@ -1,3 +1,9 @@
+import hashlib
+import json
+import os
+from collections import namedtuple
+from functools import lru_cache
+
 import h5py
 import numpy as np
 from scipy.special import erfc, erfcinv
@@ -26,3 +32,72 @@ def get_bilby_prior(filename: str):
         priors_dict = json.loads(hdf_file["priors"][()], object_hook=decode_bilby_json)
         priors = CBCPriorDict._get_from_json_dict(priors_dict)
     return priors
+
+
+PriorBounds = namedtuple("PriorBounds", ["name", "minimum", "maximum", "boundary"])
+
+
+class PriorSummary:
+    """Lightweight summary of the priors in a bilby result file.
+
+    Contains the class name, bounds and boundary type of each prior, which
+    can be accessed in the same way as a bilby prior dictionary, e.g.
+    :code:`summary["chirp_mass"].minimum`. Two summaries are equal if the
+    canonical JSON of the priors is identical.
+
+    Parameters
+    ----------
+    priors_json : str
+        JSON string of the priors as stored in the result file.
+    """
+
+    def __init__(self, priors_json):
+        priors = json.loads(priors_json)
+        canonical = json.dumps(priors, sort_keys=True, separators=(",", ":"))
+        self.hash = hashlib.sha256(canonical.encode()).hexdigest()
+        self.bounds = {}
+        for key, prior in priors.items():
+            if not isinstance(prior, dict) or "kwargs" not in prior:
+                continue
+            kwargs = prior["kwargs"]
+            minimum = kwargs.get("minimum", kwargs.get("peak"))
+            maximum = kwargs.get("maximum", kwargs.get("peak"))
+            self.bounds[key] = PriorBounds(
+                prior.get("__name__"), minimum, maximum, kwargs.get("boundary")
+            )
+
+    def __getitem__(self, key):
+        return self.bounds[key]
+
+    def __contains__(self, key):
+        return key in self.bounds
+
+    def __iter__(self):
+        return iter(self.bounds)
+
+    def __eq__(self, other):
+        if not isinstance(other, PriorSummary):
+            return NotImplemented
+        return self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+
+@lru_cache(maxsize=None)
+def _read_prior_summary(filename, size, mtime):
+    with h5py.File(filename, "r") as hdf_file:
+        return PriorSummary(hdf_file["priors"][()])
+
+
+def get_prior_summary(filename: str):
+    """Get a :code:`PriorSummary` of the priors in a bilby result file.
+
+    This does not import bilby, so it is much faster than
+    :code:`get_bilby_prior` when only the bounds are needed or to check if
+    two files have the same priors. Results are memoised per file and are
+    invalidated if the file is modified.
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    return _read_prior_summary(filename, stat.st_size, stat.st_mtime_ns)